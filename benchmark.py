@@ -0,0 +1,76 @@
+#!/usr/bin/python
+
+# SENTINEL BENCHMARK
+# Replays recorded video through face detection as fast as possible, for each detection
+# configuration, and reports throughput, per-frame latency and detection counts.
+#
+# Usage: benchmark.py [options] SOURCE [SOURCE ...]
+#
+# Each SOURCE is a video file or a directory of images. Besides the detection options of
+# sentinel.py (e.g. --track, --detect-scale), which apply to every configuration:
+#   --sizes=LIST          comma-separated image dimensions to benchmark.
+#                         Default: 320x240,640x480
+#   --frontal-only        skip the --profile configurations
+
+import sys
+import time
+from camera import Camera
+from metrics import Histogram
+from options import build_parser, parse_options
+
+# replays one source through face detection and returns its statistics
+def run(opts):
+    camera = Camera(opts)
+    latency = Histogram(size=1 << 16)
+    frames = frames_with_faces = 0
+
+    start = time.time()
+    while True:
+        frame_start = time.time()
+        try:
+            face_detected = camera.face_detect()[0]
+        except EOFError:
+            break
+        camera.frame_done()
+        latency.record(time.time() - frame_start)
+        frames += 1
+        if face_detected:
+            frames_with_faces += 1
+    elapsed = time.time() - start
+
+    stats = latency.summary()
+    stats['frames'] = frames
+    stats['fps'] = frames / elapsed if elapsed > 0 else 0
+    stats['frames_with_faces'] = frames_with_faces
+    return stats
+
+if __name__ == '__main__':
+    parser = build_parser(usage="%prog [options] SOURCE [SOURCE ...]")
+    parser.add_option("--sizes", dest="sizes", default="320x240,640x480",
+                      help="comma-separated image dimensions to benchmark. Default: 320x240,640x480",
+                      metavar="LIST")
+    parser.add_option("--frontal-only", action="store_true", dest="frontal_only", default=False,
+                      help="skip the --profile configurations")
+    opts, sources = parse_options(parser)
+    if not sources:
+        parser.error("no video file or image directory given")
+
+    # detection runs flat out, so there is nothing to display and nothing to print per frame
+    opts.no_display = True
+    opts.verbose = False
+
+    print '%-24s %-10s %-8s %7s %8s %9s %9s %9s %9s %7s' % (
+        'source', 'size', 'profile', 'frames', 'fps', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'faces')
+    for source in sources:
+        for size in opts.sizes.split(','):
+            for profile in ([False] if opts.frontal_only else [False, True]):
+                opts.camera = source
+                opts.image_dimensions = size
+                opts.profile = profile
+                stats = run(opts)
+                if not stats['frames']:
+                    sys.exit("No frames could be read from " + source)
+                print '%-24s %-10s %-8s %7d %8.1f %9.2f %9.2f %9.2f %9.2f %7d' % (
+                    source[-24:], size, 'on' if profile else 'off', stats['frames'], stats['fps'],
+                    1000 * stats['p50'], 1000 * stats['p95'], 1000 * stats['p99'], 1000 * stats['max'],
+                    stats['frames_with_faces'])
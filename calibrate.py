@@ -0,0 +1,165 @@
+#!/usr/bin/python
+
+# SENTINEL CALIBRATION
+# Measures how fast the launcher turns. It is moved for known times each way, and the shift of the
+# camera image over each move is measured by phase correlation of the frames before and after it.
+# The speeds (and how long it takes to cross each axis) are saved as a profile of this launcher,
+# which sentinel.py and supervisor.py load at startup in place of the built-in estimates. Point the
+# camera at a still scene with some texture (not a blank wall) and keep out of the picture.
+#
+# Usage: calibrate.py [options]
+#
+# Of the options of sentinel.py, the launcher, camera, size and calibration options apply. Besides
+# those:
+#   --repeats=NUM         moves measured per direction and length. Default: 3
+#   --no-range            keep the current ranges rather than measuring how long it
+#                         takes to cross each axis (driving against the end stops)
+
+import json
+import os
+import sys
+import time
+import cv2
+import numpy
+from camera import Camera
+from options import build_parser, parse_options
+from turret import Turret, calibration_path
+
+# moves are timed to shift the view by these fractions of the image (phase correlation cannot
+# measure shifts of more than half of it)
+STEPS = [.1, .2, .3]
+
+def grayscale(img):
+    return numpy.float32(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+
+# (dx, dy) shift in pixels between two grayscale images
+def image_shift(before, after):
+    window = cv2.createHanningWindow((before.shape[1], before.shape[0]), cv2.CV_32F)
+    shift = cv2.phaseCorrelate(before, after, window)
+    if isinstance(shift[0], tuple):  # newer versions of OpenCV also return the peak's response
+        shift = shift[0]
+    return shift
+
+# moves the turret in a direction for the given seconds, and returns how far the view moved along
+# that axis, as a fraction of the image's width or height
+def measure(turret, camera, direction, seconds):
+    turret.motion.wait()
+    before = grayscale(camera.snapshot(captured_after=time.time()))
+    turret.motion.submit([(direction, seconds)])
+    turret.motion.wait()
+    after = grayscale(camera.snapshot(captured_after=time.time()))
+    dx, dy = image_shift(before, after)
+    if direction & (turret.launcher.LEFT | turret.launcher.RIGHT):
+        return abs(dx) / before.shape[1]
+    return abs(dy) / before.shape[0]
+
+# seconds per image moved, as the slope of the image shift over the time moved (the intercept soaks
+# up the time the motors take to get going); None if the shifts don't grow with time
+def fit_speed(samples):
+    seconds, shifts = numpy.array(samples, dtype=float).T
+    slope, intercept = numpy.polyfit(seconds, shifts, 1)
+    return 1 / slope if slope > 0 else None
+
+# measures the speed of each direction with moves of every length in STEPS, alternating between
+# the two directions of an axis so that the turret stays around the middle of its range
+def measure_speeds(turret, camera, repeats):
+    launcher = turret.launcher
+    speeds = {}
+    for axis in [(launcher.RIGHT, launcher.LEFT), (launcher.DOWN, launcher.UP)]:
+        samples = dict((direction, []) for direction in axis)
+        for step in STEPS:
+            for i in range(repeats):
+                for direction in axis:
+                    seconds = step * launcher.speed(direction)
+                    samples[direction].append((seconds, measure(turret, camera, direction, seconds)))
+        for direction in axis:
+            speeds[direction] = fit_speed(samples[direction])
+    return speeds
+
+# seconds it takes to cross an axis: the turret is driven against the end stop of one direction,
+# then stepped the other way until the view stops moving. Only the time that moved the view counts,
+# so that the motors getting going at every step doesn't add up. None if it never seemed to reach
+# the other end stop, or seemed to reach it far sooner than expected (e.g. when the steps are so
+# short that getting the motors going takes up most of them, or the scene has too little texture
+# for the shifts to be measured).
+def measure_range(turret, camera, home, direction, current_range):
+    launcher = turret.launcher
+    turret.motion.submit([(home, 1.5 * current_range)])
+    step = .2
+    elapsed = 0.0
+    while elapsed < launcher.calibration_tolerance * current_range:
+        shift = measure(turret, camera, direction, step * launcher.speed(direction))
+        elapsed += shift * launcher.speed(direction)
+        if shift < step / 2:
+            # ran into the end stop
+            return elapsed if launcher.plausible(elapsed, current_range) else None
+    return None
+
+if __name__ == '__main__':
+    parser = build_parser()
+    parser.add_option("--repeats", dest="repeats", default=3, type="int",
+                      help="moves measured per direction and length. Default: 3", metavar="NUM")
+    parser.add_option("--no-range", action="store_false", dest="measure_range", default=True,
+                      help="keep the current ranges rather than measuring how long it takes to cross "
+                           "each axis (driving against the end stops)")
+    opts, args = parse_options(parser)
+    if not opts.calibration:
+        parser.error("--calibration must name the directory to save the profile in")
+    if opts.repeats < 1:
+        parser.error("--repeats must be at least 1")
+
+    if (sys.platform == 'linux2' or sys.platform == 'darwin') and not os.geteuid() == 0 and opts.launcherID != 'sim':
+        sys.exit("Script must be run as root.")
+
+    # an existing profile is loaded by the turret, and refined: its speeds set the length of the moves
+    camera = Camera(opts)
+    turret = Turret(opts)
+    launcher = turret.launcher
+    path = calibration_path(opts.calibration, opts.launcherID, launcher.device)
+    if path is None:
+        turret.dispose()
+        camera.dispose()
+        sys.exit("This launcher has no serial number and the USB port it is plugged into is unknown, so "
+                 "a profile could not be told apart from those of others of its model.")
+    try:
+        camera.wait_for_frame()
+        turret.center()
+
+        print 'Measuring speeds ...'
+        speeds = measure_speeds(turret, camera, opts.repeats)
+        profile = launcher.calibration()
+        for name, direction in launcher.directionNames():
+            if launcher.plausible(speeds[direction], launcher.speed(direction)):
+                profile['speeds'][name] = speeds[direction]
+            else:
+                print 'Could not measure the speed going %s, keeping %.3f' % (name, launcher.speed(direction))
+        launcher.calibrate(profile)
+
+        if opts.measure_range:
+            print 'Measuring ranges ...'
+            for name, home, direction in [('x_range', launcher.LEFT, launcher.RIGHT),
+                                          ('y_range', launcher.UP, launcher.DOWN)]:
+                seconds = measure_range(turret, camera, home, direction, getattr(launcher, name))
+                if seconds is None:
+                    print 'Could not measure %s, keeping %.2f' % (name, getattr(launcher, name))
+                else:
+                    profile[name] = seconds
+            launcher.calibrate(profile)
+
+        turret.homed_at = None
+        turret.center()
+        turret.motion.wait()
+    finally:
+        turret.dispose()
+        camera.dispose()
+
+    for name, direction in launcher.directionNames():
+        print '%-5s %.3f seconds per image' % (name, profile['speeds'][name])
+    print 'range %.2f seconds across, %.2f seconds up and down' % (profile['x_range'], profile['y_range'])
+
+    if not os.path.exists(opts.calibration):
+        os.makedirs(opts.calibration)
+    profile['measured'] = time.time()
+    with open(path, 'w') as f:
+        json.dump(profile, f, indent=2, sort_keys=True)
+    print 'Saved ' + path
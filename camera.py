@@ -1,18 +1,129 @@
+import functools
 import os
 import threading
 import cv2
+import numpy
 import time
 import subprocess
 import sys
+import Queue
+from metrics import metrics, clock
+from framesource import open_source
+from cascades import CascadeLoader
+from tracker import Tracker
+from motion import MotionGate
+from nms import merge_passes
+from scheduler import FrameBudget
 
 FNULL = open(os.devnull, 'w')
 
+# scales an [x, y, w, h] box between detection and full image coordinates
+def scale_box(box, scale):
+    return [int(round(v * scale)) for v in box]
+
+def draw_reticule(img, x, y, width, height, color, style="corners"):
+    w, h = width, height
+    if style == "corners":
+        cv2.line(img, (x, y), (x+w/3, y), color, 2)
+        cv2.line(img, (x+2*w/3, y), (x+w, y), color, 2)
+        cv2.line(img, (x+w, y), (x+w, y+h/3), color, 2)
+        cv2.line(img, (x+w, y+2*h/3), (x+w, y+h), color, 2)
+        cv2.line(img, (x, y), (x, y+h/3), color, 2)
+        cv2.line(img, (x, y+2*h/3), (x, y+h), color, 2)
+        cv2.line(img, (x, y+h), (x+w/3, y+h), color, 2)
+        cv2.line(img, (x+2*w/3, y+h), (x+w, y+h), color, 2)
+    else:
+        cv2.rectangle(img, (x, y), (x+w, y+h), color)
+
+# draws the faces found in a grayscale image over a color copy of it (out, if given), so that the red
+# targets stand out against a grayscale photo, for an especially ominous effect. boxes are
+# ([x, y, w, h], is target) pairs; the target gets corners and the other faces a plain box
+def render_overlay(gray, boxes, out=None):
+    start = clock()
+    img = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR, out)
+    for (x, y, w, h), is_target in boxes:
+        if is_target:
+            draw_reticule(img, x, y, w, h, (0, 0, 170), "corners")
+        else:
+            draw_reticule(img, x, y, w, h, (0, 0, 60), "box")
+    metrics.record_since('render.overlay', start)
+    return img
+
+# runs one detectMultiScale pass and returns the faces found as an (N, 4) array of [x, y, w, h] rows,
+# along with an array of how confident the cascade is of each (its final stage's level weights, where
+# OpenCV provides detectMultiScale3, and all equal otherwise). If mirrored, the pass runs on the
+# horizontally flipped image (e.g. to find right profiles) and the faces are flipped back
+def run_cascade(classifier, img, mirrored=False, **kwargs):
+    if mirrored:
+        img_in = cv2.flip(img, 1)
+    else:
+        img_in = img
+    if hasattr(classifier, 'detectMultiScale3'):
+        faces, levels, weights = classifier.detectMultiScale3(img_in, outputRejectLevels=True, **kwargs)
+    else:
+        faces, weights = classifier.detectMultiScale(img_in, **kwargs), None
+
+    # detectMultiScale returns an empty tuple rather than an empty array when there are no faces
+    faces = numpy.array(faces, dtype=numpy.int32).reshape(-1, 4)
+    if weights is None:
+        weights = numpy.ones(len(faces))
+    else:
+        weights = numpy.array(weights, dtype=float).reshape(-1)
+    if mirrored:
+        faces[:, 0] = img.shape[1] - (faces[:, 0] + faces[:, 2])
+    return faces, weights
+
+# A thread with its own CascadeClassifier that runs detectMultiScale passes handed to it.
+# OpenCV releases the GIL while detecting, so passes on separate workers run in parallel.
+class CascadeWorker():
+    def __init__(self, classifier, name, mirrored=False):
+        self.classifier = classifier
+        self.name = name  # used to label timing metrics
+        self.mirrored = mirrored  # detect on the horizontally flipped image, e.g. for right profiles
+
+        self.tasks = Queue.Queue()
+        self.results = Queue.Queue()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, img, **kwargs):
+        self.tasks.put((img, kwargs))
+
+    # blocks until the pass submitted earlier is done, and returns its faces and weights (see run_cascade)
+    def result(self):
+        faces = self.results.get()
+        if isinstance(faces, Exception):
+            raise faces
+        return faces
+
+    def run(self):
+        while True:
+            img, kwargs = self.tasks.get()
+            start = clock()
+            try:
+                faces = run_cascade(self.classifier, img, self.mirrored, **kwargs)
+            except Exception, e:
+                faces = e  # re-raised on the thread waiting for the result
+            metrics.record_since('detect.' + self.name, start)
+            self.results.put(faces)
+
 class Camera():
     def __init__(self, opts):
         self.opts = opts
         self.current_image_viewer = None  # image viewer not yet launched
 
-        self.webcam = cv2.VideoCapture(int(self.opts.camera))  # open a channel to our camera
+        # the cascades are parsed in the background while the camera is opened. Each profile worker
+        # needs a classifier of its own, as classifiers are not safe to share between threads
+        loaders = [CascadeLoader(self.opts.haar_file, 'frontal')]
+        if opts.profile:
+            loaders += [CascadeLoader(self.opts.haar_profile_file, 'profile_left'),
+                        CascadeLoader(self.opts.haar_profile_file, 'profile_right')]
+
+        # open a channel to our camera (or a recording; those are replayed frame by frame,
+        # at the pace face_detect() consumes them, and end with an EOFError)
+        start = clock()
+        self.webcam, self.live = open_source(self.opts.camera)
         if not self.webcam.isOpened():  # return error if unable to connect to hardware
             raise ValueError('Error connecting to specified camera')
 
@@ -20,20 +131,91 @@ class Camera():
         img_w, img_h = map(int, self.opts.image_dimensions.split('x'))
         self.resolution_set = self.webcam.set(cv2.cv.CV_CAP_PROP_FRAME_WIDTH,img_w)
         self.resolution_set =  self.resolution_set  and self.webcam.set(cv2.cv.CV_CAP_PROP_FRAME_HEIGHT,img_h)
+        metrics.record_since('startup.camera_open', start)
 
+        # region-of-interest tracking state: the last face found, and how long ago we last
+        # missed it or scanned the whole frame for it
+        self.track_box = None
+        self.track_misses = 0
+        self.frames_since_full_scan = 0
 
-        # initialize classifier with training set of faces
-        self.face_filter = cv2.CascadeClassifier(self.opts.haar_file)
-        if (opts.profile):
-            self.profile_filter = cv2.CascadeClassifier(self.opts.haar_profile_file)            
+        # with --motion-gate, frames in which nothing moved are not searched at all
+        self.motion_gate = MotionGate() if opts.motion_gate else None
+        self.frames_gated = 0
+        metrics.gauge('detect.frames_gated', lambda: self.frames_gated)
+
+        # detector settings (see FrameBudget), chosen per frame by the frame budget with --target-fps
+        self.detect_settings = {'scale': opts.detect_scale, 'scale_factor': 1.1, 'min_size': 0,
+                                'profile': opts.profile, 'detect_every': opts.detect_every}
+        self.frame_budget = None
+        if opts.target_fps:
+            img_h = int(self.opts.image_dimensions.split('x')[1])
+            self.frame_budget = FrameBudget(opts.target_fps, self.detect_settings, img_h)
+        self.processing_start = None  # when face_detect() picked up the current frame
+        self.settings = self.detect_settings
+        self.min_face = 0  # smallest face looked for in the current frame, in detection image pixels
+
+        # follows faces across frames and chooses which one to aim at; with --detect-every, the
+        # tracker's predictions stand in for detection on the frames in between
+        self.tracker = Tracker()
+        self.tracks = []  # (track, box) pairs of the faces in the current frame
+        self.frames_since_detection = 0
+        self.face_cascades = []  # which cascade found each face of the last detection pass
+        self.cascade_names = ['frontal', 'profile_left', 'profile_right']
+        self.target = None  # the track aimed at in the current frame
+
+        # the annotated image (see annotated()) is only rendered on demand, once per frame
+        self.gray = None
+        self.annotated_img = None
+        self.annotated_seq = None
+
+        # captured frames are kept in a ring of slots (filled in place where OpenCV supports it,
+        # see grab_frames()). The newest one is handed to face_detect() by index, and stays owned by it
+        # (as self.current_frame) until its next call
+        self.ring_size = 3  # one being written, one waiting to be picked up, one held by face_detect()
+        self.frame_ring = [None] * self.ring_size
+        self.latest_index = None
+        self.held_index = None
+        self.current_frame = None
+
+        # every captured frame gets a sequence number and the time it was captured at
+        self.ring_seqs = [0] * self.ring_size
+        self.ring_times = [0.0] * self.ring_size
+        self.latest_seq = 0  # sequence number of the newest frame (0 until the first one arrives)
+        self.frame_seq = 0   # sequence number and capture time of current_frame
+        self.frame_time = 0.0
+        self.waiting_consumers = 0  # threads blocked in wait_for_frame()
+        self.end_of_stream = False  # set once a recording has been replayed completely
+
+        # measured capture throughput: grab rate and decode time are moving averages, and a frame
+        # counts as dropped if it was grabbed but never picked up by face_detect()
+        self.capture_fps = 0.0
+        self.decode_time = 0.0
+        self.frames_grabbed = 0
+        self.frames_decoded = 0
+        self.frames_dropped = 0
+        metrics.gauge('capture.fps', lambda: round(self.capture_fps, 1))
+        metrics.gauge('capture.frames_grabbed', lambda: self.frames_grabbed)
+        metrics.gauge('capture.frames_decoded', lambda: self.frames_decoded)
+        metrics.gauge('capture.frames_dropped', lambda: self.frames_dropped)
+
+        # reusable buffers for the per-frame resize and color conversions
+        self.scratch_buffers = {}
 
         # create a separate thread to grab frames from camera.  This prevents a frame buffer from filling up with old images
         self.camThread = threading.Thread(target=self.grab_frames)
         self.camThread.daemon = True
         self.currentFrameLock = threading.Lock()
-        self.new_frame_available = False
+        self.frameCondition = threading.Condition(self.currentFrameLock)  # notified on every new frame
         self.camThread.start()
 
+        # initialize classifier with training set of faces (capture is already running meanwhile)
+        self.face_filter = loaders[0].get()
+        if (opts.profile):
+            # the two profile passes run on their own workers, alongside the frontal pass
+            self.profile_workers = [CascadeWorker(loaders[1].get(), 'profile_left'),
+                                    CascadeWorker(loaders[2].get(), 'profile_right', mirrored=True)]
+
     # turn off camera properly
     def dispose(self):
         if sys.platform == 'linux2' or sys.platform == 'darwin':
@@ -43,110 +225,332 @@ class Camera():
             self.webcam.release()
 
 
-    # runs to grab latest frames from camera
+    # runs to grab latest frames from camera, as fast as the camera delivers them
+    # (grab() blocks until the next frame is ready, so there is no need to pace this loop)
     def grab_frames(self):
+            last_capture_time = None
             while(1): # loop until process is shut down
+                if not self.live:
+                    # don't skip any frames of a recording: wait until the last one has been picked up
+                    self.frameCondition.acquire()
+                    while self.latest_seq > self.frame_seq:
+                        self.frameCondition.wait()
+                    self.frameCondition.release()
+
                 if not self.webcam.grab():
+                    if not self.live:
+                        self.frameCondition.acquire()
+                        self.end_of_stream = True
+                        self.frameCondition.notify_all()
+                        self.frameCondition.release()
+                        return
                     raise ValueError('frame grab failed')
-                time.sleep(.015)
-                retval, most_recent_frame = self.webcam.retrieve(channel=0)
-                if not retval:
-                    raise ValueError('frame capture failed')
+                capture_time = time.time()
+                self.frames_grabbed += 1
+                if last_capture_time is not None and capture_time > last_capture_time:
+                    self.capture_fps = 0.9 * self.capture_fps + 0.1 / (capture_time - last_capture_time)
+                last_capture_time = capture_time
+
+                # with --lazy-decode only decode frames somebody is waiting for, so that a consumer that
+                # has fallen behind gets the newest frame without paying to decode all the ones it missed
+                if self.live and self.opts.lazy_decode and self.waiting_consumers == 0 and self.latest_seq > 0:
+                    self.frames_dropped += 1
+                    continue
+
+                # decode into a buffer that is neither waiting to be picked up nor held by face_detect()
                 self.currentFrameLock.acquire()
-                self.current_frame = most_recent_frame
-                self.new_frame_available = True
+                index = (self.latest_index + 1) % self.ring_size if self.latest_index is not None else 0
+                while index == self.held_index:
+                    index = (index + 1) % self.ring_size
                 self.currentFrameLock.release()
-                time.sleep(.015)
 
+                # OpenCV 3 and later fill the buffer passed to retrieve() (while the frame size stays
+                # the same), but OpenCV 2.4 returns a newly allocated frame every time. Either way the
+                # slot's frame is only replaced while nobody holds it, so face_detect() needs no copy.
+                decode_start = time.time()
+                retval, most_recent_frame = self.webcam.retrieve(self.frame_ring[index], 0)
+                if not retval:
+                    raise ValueError('frame capture failed')
+                decode_duration = time.time() - decode_start
+                self.decode_time = 0.9 * self.decode_time + 0.1 * decode_duration
+                metrics.record('capture.decode', decode_duration)
+                self.frames_decoded += 1
+
+                self.frameCondition.acquire()
+                if self.latest_seq > self.frame_seq:
+                    self.frames_dropped += 1  # the previous frame is being replaced before it was used
+                self.frame_ring[index] = most_recent_frame
+                self.latest_seq += 1
+                self.ring_seqs[index] = self.latest_seq
+                self.ring_times[index] = capture_time
+                self.latest_index = index
+                self.frameCondition.notify_all()
+                self.frameCondition.release()
 
-    # runs facial recognition on our previously captured image and returns
-    # (x,y)-distance between target and center (as a fraction of image dimensions)
-    def face_detect(self, filename=None):
-        def draw_reticule(img, x, y, width, height, color, style="corners"):
-            w, h = width, height
-            if style == "corners":
-                cv2.line(img, (x, y), (x+w/3, y), color, 2)
-                cv2.line(img, (x+2*w/3, y), (x+w, y), color, 2)
-                cv2.line(img, (x+w, y), (x+w, y+h/3), color, 2)
-                cv2.line(img, (x+w, y+2*h/3), (x+w, y+h), color, 2)
-                cv2.line(img, (x, y), (x, y+h/3), color, 2)
-                cv2.line(img, (x, y+2*h/3), (x, y+h), color, 2)
-                cv2.line(img, (x, y+h), (x+w/3, y+h), color, 2)
-                cv2.line(img, (x+2*w/3, y+h), (x+w, y+h), color, 2)
+    # blocks until a frame newer than after_seq (and, if given, captured no earlier than the time
+    # captured_after) is available, and returns its sequence number, or None after timeout seconds.
+    # Raises EOFError if a recording has ended without such a frame.
+    def wait_for_frame(self, after_seq=0, timeout=None, captured_after=None):
+        def ready():
+            if (self.latest_seq > after_seq and
+                    (captured_after is None or self.ring_times[self.latest_index] >= captured_after)):
+                return True
+            if self.end_of_stream:
+                raise EOFError('end of recording')
+            return False
+
+        self.frameCondition.acquire()
+        self.waiting_consumers += 1
+        try:
+            if timeout is None:
+                while not ready():
+                    self.frameCondition.wait()
             else:
-                cv2.rectangle(img, (x, y), (x+w, y+h), color)
+                deadline = time.time() + timeout
+                while not ready():
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    self.frameCondition.wait(remaining)
+            return self.latest_seq
+        finally:
+            self.waiting_consumers -= 1
+            self.frameCondition.release()
 
+    # returns a copy of the newest frame, once one captured no earlier than captured_after is in
+    # (for uses other than face_detect(), e.g. calibration)
+    def snapshot(self, captured_after=None):
+        self.wait_for_frame(captured_after=captured_after)
+        self.frameCondition.acquire()
+        frame = self.frame_ring[self.latest_index].copy()
+        self.frameCondition.release()
+        return frame
+
+    # returns a reusable uint8 buffer of the given shape, so that conversions don't allocate per frame
+    def scratch(self, name, shape):
+        buf = self.scratch_buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = numpy.empty(shape, numpy.uint8)
+            self.scratch_buffers[name] = buf
+        return buf
+
+
+    # runs facial recognition on the next captured image (optionally the next one captured no
+    # earlier than captured_after) and returns
+    # (x,y)-distance between target and center (as a fraction of image dimensions)
+    def face_detect(self, filename=None, captured_after=None):
         # load image, then resize it to specified size
-        while not self.new_frame_available:
-            time.sleep(.001)
-        self.currentFrameLock.acquire()
-        img = self.current_frame.copy()
-        self.new_frame_available = False
-        self.currentFrameLock.release()
+        self.wait_for_frame(self.frame_seq, captured_after=captured_after)
 
+        # take ownership of the newest frame; this also hands the previously held one back to the ring
+        self.frameCondition.acquire()
+        self.held_index = self.latest_index
+        self.current_frame = self.frame_ring[self.held_index]
+        self.frame_seq = self.ring_seqs[self.held_index]
+        self.frame_time = self.ring_times[self.held_index]
+        self.frameCondition.notify_all()  # a recording's capture thread waits for this
+        self.frameCondition.release()
+        img = self.current_frame
+        if self.frame_budget:
+            self.settings = self.frame_budget.settings()
+
+        start = clock()
+        self.processing_start = start
         img_w, img_h = map(int, self.opts.image_dimensions.split('x'))
         if not self.resolution_set:
-            img = cv2.resize(img, (img_w, img_h))
+            img = cv2.resize(img, (img_w, img_h), self.scratch('resized', (img_h, img_w) + img.shape[2:]))
 
 
         #convert to grayscale since haar operates on grayscale images anyways
-        img = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-
-        # detect faces (might want to make the minNeighbors threshold adjustable)
-        faces = self.face_filter.detectMultiScale(img, minNeighbors=4)
+        img = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY, self.scratch('gray', img.shape[:2]))
+        self.gray = img  # kept for annotated(); a scratch buffer, overwritten by the next call
 
-        # a bit silly, but works correctly regardless of whether faces is an ndarray or empty tuple
-        faces = map(lambda f: f.tolist(), faces)
-
-        if (self.opts.profile): #if profile detection is enabled, runs two additional filters to detect side views of faces
-            faces_left = self.profile_filter.detectMultiScale(img, minNeighbors=4)
-            faces_right = self.profile_filter.detectMultiScale(cv2.flip(img,1), minNeighbors=4)
-            faces_left = map(lambda f: f.tolist(), faces_left)
-            faces_right = map(lambda f: f.tolist(), faces_right)
-            for row in faces_right:
-                row[0] = img_w - (row[0] + row[3])
-            faces = faces + faces_left + faces_right #concatenate lists of faces
+        # optionally run the cascades on a downscaled copy; faces are mapped back to full size below
+        scale = self.settings['scale']
+        if scale != 1:
+            detect_w, detect_h = int(round(img.shape[1] * scale)), int(round(img.shape[0] * scale))
+            detect_img = cv2.resize(img, (detect_w, detect_h), self.scratch('detect', (detect_h, detect_w)),
+                                    interpolation=cv2.INTER_AREA)
+        else:
+            detect_img = img
+        self.min_face = int(round(detect_img.shape[0] * self.settings['min_size']))
+        metrics.record_since('convert.gray', start)
 
-        # convert back from grayscale, so that we can draw red targets over a grayscale
-        # photo, for an especially ominous effect
-        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        # while following a face, only run detection on every detect_every-th frame
+        if self.frames_since_detection + 1 < self.settings['detect_every'] and self.tracker.target():
+            self.frames_since_detection += 1
+            self.tracks = self.tracker.predict(self.frame_time)
+        else:
+            self.frames_since_detection = 0
+            faces = self.run_detection(detect_img, scale)
+            self.tracks = self.tracker.update(faces.tolist(), self.frame_time, self.face_cascades)
+        self.target = self.tracker.target()
+        metrics.record('capture.to_detect', time.time() - self.frame_time)
 
         if self.opts.verbose:
-            print 'faces detected: ' + str(faces)
-
-        # sort by size of face (we use the last face for computing x_adj, y_adj)
-        faces.sort(key=lambda face: face[2]*face[3])
+            print 'faces detected: ' + str([box for track, box in self.tracks])
 
         x_adj, y_adj = (0, 0)  # (x,y)-distance from center, as a fraction of image dimensions
         face_y_size = 0  # height of the detected face, used to gauge distance to target
-        if len(faces) > 0:
-            face_detected = True
+        face_detected = False
+        for track, (x, y, w, h) in self.tracks:
+            if track is self.target:
+                # calculate distance from center
+                face_detected = True
+                self.track_box = [x, y, w, h]
+                x_adj = ((x + w/2) - img_w/2) / float(img_w)
+                y_adj = ((y + h/2) - img_h/2) / float(img_h)
+                face_y_size = h / float(img_h)
 
-            # draw a rectangle around all faces except last face
-            for (x, y, w, h) in faces[:-1]:
-                draw_reticule(img, x, y, w, h, (0, 0, 60), "box")
+        # nothing is drawn until somebody asks for the annotated image
+        if filename:    #save to file if desired
+            cv2.imwrite(filename, self.annotated())
 
-            # get last face, draw target, and calculate distance from center
-            (x, y, w, h) = faces[-1]
-            draw_reticule(img, x, y, w, h, (0, 0, 170), "corners")
-            x_adj = ((x + w/2) - img_w/2) / float(img_w)
-            y_adj = ((y + h/2) - img_h/2) / float(img_h)
-            face_y_size = h / float(img_h)
+        return face_detected, x_adj, y_adj, face_y_size
+
+    # to be called once everything has been done with the current frame (display, aiming, ...): with
+    # --target-fps, trades detection for time if that took too long, or back if there is time to spare
+    def frame_done(self):
+        if self.frame_budget and self.frame_budget.record(clock() - self.processing_start) and self.opts.verbose:
+            print 'detector settings: ' + str(self.frame_budget.settings())
+
+    # ([x, y, w, h], is target) pairs of the faces in the current frame
+    def overlay_boxes(self):
+        return [(box, track is self.target) for track, box in self.tracks]
+
+    # the current frame with its faces marked, rendered the first time it is asked for
+    # (it is a scratch buffer, so it is overwritten by the next frame's)
+    def annotated(self):
+        if self.annotated_seq != self.frame_seq:
+            self.annotated_img = render_overlay(self.gray, self.overlay_boxes(),
+                                                self.scratch('overlay', self.gray.shape + (3,)))
+            self.annotated_seq = self.frame_seq
+        return self.annotated_img
+
+    # a function that renders the annotated current frame, for rendering it on another thread
+    def overlay_renderer(self):
+        return functools.partial(render_overlay, self.gray.copy(), self.overlay_boxes())
+
+    # finds faces in the (possibly downscaled) grayscale image and returns them as an (N, 4) array of
+    # [x, y, w, h] boxes in full image coordinates
+    def run_detection(self, detect_img, scale):
+        # with --motion-gate, while no faces are being followed, only search where the scene has changed,
+        # with a full-frame scan every motion_rescan frames anyway in case somebody is standing still
+        faces = None
+        if self.motion_gate:
+            region = self.motion_gate.update(detect_img)
+            if not self.tracker.tracks and self.frames_since_full_scan < self.opts.motion_rescan:
+                if region is None:
+                    self.frames_gated += 1
+                    faces = numpy.zeros((0, 4), dtype=numpy.int32)
+                    self.face_cascades = []
+                elif region[2] * region[3] < .5 * detect_img.shape[0] * detect_img.shape[1]:
+                    faces = self.detect_in_box(detect_img, region)
+                # otherwise most of the view changed, and it may as well all be scanned
+
+        # in tracking mode, only look for the last face near where it was last seen, unless it has
+        # been missed too many times in a row or it is time for a periodic full-frame scan
+        if (faces is None and self.opts.roi_tracking and self.track_box is not None and
+                self.frames_since_full_scan < self.opts.reacquire_interval):
+            faces = self.detect_in_region(detect_img, scale_box(self.track_box, scale))
+            if len(faces) > 0:
+                self.track_misses = 0
+            else:
+                self.track_misses += 1
+                if self.track_misses >= self.opts.track_misses:
+                    faces = None
+
+        if faces is None:
+            faces = self.detect_faces(detect_img)
+            self.frames_since_full_scan = 0
+            self.track_misses = 0
+            self.track_box = None
         else:
-            face_detected = False
+            self.frames_since_full_scan += 1
 
+        if scale != 1:
+            faces = numpy.round(faces / scale).astype(numpy.int32)
+        return faces
 
-        #store modified image as class variable so that display() can access it
-        self.frame_mod = img
-        if filename:    #save to file if desired
-            cv2.imwrite(filename, img)
+    # runs the face cascades over a grayscale image and returns an (N, 4) array of [x, y, w, h] faces,
+    # optionally restricted to faces between min_size and max_size pixels. The name of the cascade
+    # that found each face is left in face_cascades
+    def detect_faces(self, img, min_size=(0, 0), max_size=(0, 0)):
+        profile = self.settings['profile']
+        min_size = (max(min_size[0], self.min_face), max(min_size[1], self.min_face))
+        params = dict(scaleFactor=self.settings['scale_factor'], minNeighbors=self.opts.min_neighbors,
+                      minSize=min_size, maxSize=max_size)
+        if profile: #if profile detection is enabled, runs two additional filters to detect side views of faces
+            for worker in self.profile_workers:
+                worker.submit(img, **params)
 
-        return face_detected, x_adj, y_adj, face_y_size
+        # detect faces
+        start = clock()
+        error = None
+        try:
+            frontal = run_cascade(self.face_filter, img, **params)
+        except Exception, e:
+            error = e
+        metrics.record_since('detect.frontal', start)
+
+        # every profile pass must be collected even if another one failed, or the next frame's passes
+        # would pick up this frame's results
+        passes = [frontal] if error is None else []
+        if profile:
+            for worker in self.profile_workers:
+                try:
+                    passes.append(worker.result())
+                except Exception, e:
+                    error = error or e
+        if error is not None:
+            raise error
+
+        if profile:
+            # the same face is often found by more than one cascade: keep only the most confident
+            start = clock()
+            faces, sources = merge_passes(passes)
+            self.face_cascades = [self.cascade_names[source] for source in sources.tolist()]
+            metrics.record_since('detect.merge', start)
+        else:
+            faces = frontal[0]
+            self.face_cascades = ['frontal'] * len(faces)
+
+        return faces
+
+    # looks for a face of roughly the same size as the given [x, y, w, h] box, in a window
+    # around it that is three times its size, and returns faces in full image coordinates
+    def detect_in_region(self, img, box):
+        x, y, w, h = box
+        img_h, img_w = img.shape[:2]
+        x0, y0 = max(0, x - w), max(0, y - h)
+        x1, y1 = min(img_w, x + 2*w), min(img_h, y + 2*h)
+
+        min_side = int(h * 0.8)
+        max_side = min(int(h * 1.25), x1 - x0, y1 - y0)
+        return self.detect_in_box(img, [x0, y0, x1 - x0, y1 - y0], (min_side, min_side), (max_side, max_side))
+
+    # maps an [x, y, w, h] box from image_dimensions to the captured frame (current_frame), which
+    # differs if the camera doesn't support the requested resolution
+    def frame_box(self, box):
+        img_w, img_h = map(int, self.opts.image_dimensions.split('x'))
+        frame_h, frame_w = self.current_frame.shape[:2]
+        x, y, w, h = box
+        return [x * frame_w / img_w, y * frame_h / img_h, w * frame_w / img_w, h * frame_h / img_h]
+
+    # runs the face cascades over the [x, y, w, h] part of an image, returning faces in image coordinates
+    def detect_in_box(self, img, box, min_size=(0, 0), max_size=(0, 0)):
+        x, y, w, h = box
+        faces = self.detect_faces(img[y:y+h, x:x+w], min_size, max_size)
+        faces[:, 0] += x
+        faces[:, 1] += y
+        return faces
 
     # display the OpenCV-processed images
     def display(self):
+            start = clock()
             #not tested on Mac, but the openCV libraries should be fairly cross-platform
-            cv2.imshow("cameraFeed", self.frame_mod)
+            cv2.imshow("cameraFeed", self.annotated())
 
             # delay of 2 ms for refreshing screen (time.sleep() doesn't work)
-            cv2.waitKey(2)
\ No newline at end of file
+            cv2.waitKey(2)
+            metrics.record_since('display', start)
\ No newline at end of file
@@ -0,0 +1,32 @@
+import threading
+import cv2
+from metrics import metrics, clock
+
+# Loads a CascadeClassifier on a background thread. OpenCV releases the GIL while parsing, so
+# cascades load in parallel with each other and with the rest of startup.
+class CascadeLoader():
+    def __init__(self, haar_file, name):
+        self.haar_file = haar_file
+        self.name = name  # used to label the startup timing metric
+        self.classifier = None
+        self.error = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # blocks until the classifier is loaded, and returns it
+    def get(self):
+        self.thread.join()
+        if self.error:
+            raise self.error
+        return self.classifier
+
+    def run(self):
+        start = clock()
+        try:
+            self.classifier = cv2.CascadeClassifier(self.haar_file)
+            if self.classifier.empty():
+                raise ValueError('Error loading cascade ' + self.haar_file)
+        except Exception, e:
+            self.error = e  # re-raised on the thread waiting for the classifier
+        metrics.record_since('startup.cascade_' + self.name, start)
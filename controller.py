@@ -0,0 +1,118 @@
+import collections
+import time
+
+# Tracks one axis of a target: where the turret is pointing (integrated from the direction it is
+# being driven in), and an alpha-beta (constant velocity) estimate of where the target is relative
+# to the turret's starting point. Positions are in the same units as x_adj/y_adj, i.e. fractions
+# of the image size.
+class AxisTracker():
+    def __init__(self, speed, alpha, beta):
+        self.rate = 1.0 / speed  # image fractions per second the view shifts while moving
+        self.alpha = alpha
+        self.beta = beta
+        self.reset()
+
+    def reset(self):
+        # pointing history, as (start time, pointing at start, direction) segments
+        self.segments = collections.deque([(time.time(), 0.0, 0)], maxlen=16)
+        self.position = None  # estimated target position, its velocity and the time of the estimate
+        self.velocity = 0.0
+        self.estimate_time = None
+
+    def set_direction(self, direction, at_time):
+        self.segments.append((at_time, self.pointing(at_time), direction))
+
+    # where the turret was pointing at the given time
+    def pointing(self, at_time):
+        for start, pointing, direction in reversed(self.segments):
+            if start <= at_time:
+                return pointing + direction * self.rate * (at_time - start)
+        return self.segments[0][1]
+
+    # updates the estimate with the target's offset from center in a frame captured at frame_time
+    def update(self, offset, frame_time):
+        measured = offset + self.pointing(frame_time)
+        if self.position is None:
+            self.position = measured
+        elif frame_time > self.estimate_time:
+            dt = frame_time - self.estimate_time
+            predicted = self.position + self.velocity * dt
+            residual = measured - predicted
+            self.position = predicted + self.alpha * residual
+            self.velocity += self.beta * residual / dt
+        self.estimate_time = frame_time
+
+    # predicted offset of the target from center, lead seconds from now
+    def error(self, now, lead):
+        return self.position + self.velocity * (now - self.estimate_time + lead) - self.pointing(now)
+
+# Closed-loop alternative to Turret.adjust(). Instead of a timed move followed by a stop and a settle
+# delay for every correction, it runs on every frame and keeps the turret moving in whichever direction
+# brings the target, as predicted a little into the future, towards the center of the image.
+class TrackingController():
+    def __init__(self, turret, lead=.15, deadband=.03, alpha=.5, beta=.1, coast=.5):
+        self.turret = turret
+        self.launcher = turret.launcher
+        self.lead = lead          # seconds to look ahead, covering detection and USB latency
+        self.deadband = deadband  # start moving once the predicted error is larger than this
+        self.coast = coast        # seconds to keep following the prediction after losing the target
+        self.x = AxisTracker(self.launcher.x_speed, alpha, beta)
+        self.y = AxisTracker(self.launcher.y_speed, alpha, beta)
+        self.x_direction = 0  # -1, 0 or 1 for left/none/right, and up/none/down
+        self.y_direction = 0
+        self.last_seen = None
+        self.direction_changes = 0
+        turret.stats.gauge('control.direction_changes', lambda: self.direction_changes)
+
+    # forgets the target and stops the turret, e.g. when something else takes over the turret
+    def reset(self):
+        if self.x_direction or self.y_direction:
+            self.turret.motion.cancel()
+        self.x_direction = self.y_direction = 0
+        self.x.reset()
+        self.y.reset()
+        self.last_seen = None
+
+    # called once per frame with the detection result for the frame captured at frame_time
+    def update(self, face_detected, x_adj, y_adj, frame_time):
+        now = time.time()
+        if face_detected:
+            self.x.update(x_adj, frame_time)
+            self.y.update(y_adj, frame_time)
+            self.last_seen = now
+        elif self.last_seen is None:
+            return
+        elif now - self.last_seen > self.coast:
+            self.reset()
+            return
+
+        x_direction = self.axis_direction(self.x.error(now, self.lead), self.x_direction)
+        y_direction = self.axis_direction(self.y.error(now, self.lead), self.y_direction)
+        if (x_direction, y_direction) != (self.x_direction, self.y_direction):
+            self.x.set_direction(x_direction, now)
+            self.y.set_direction(y_direction, now)
+            self.x_direction, self.y_direction = x_direction, y_direction
+            self.turret.motion.drive(self.direction_bitmask())
+            self.direction_changes += 1
+
+    # bang-bang control with hysteresis: start moving when the error leaves the deadband, and keep
+    # going until it is back within half of it
+    def axis_direction(self, error, current):
+        threshold = self.deadband / 2 if current else self.deadband
+        if error > threshold:
+            return 1
+        if error < -threshold:
+            return -1
+        return 0
+
+    def direction_bitmask(self):
+        direction = 0
+        if self.x_direction > 0:
+            direction |= self.launcher.RIGHT
+        elif self.x_direction < 0:
+            direction |= self.launcher.LEFT
+        if self.y_direction > 0:
+            direction |= self.launcher.DOWN
+        elif self.y_direction < 0:
+            direction |= self.launcher.UP
+        return direction
@@ -0,0 +1,42 @@
+import os
+import cv2
+
+# Replays a directory of still images, in filename order, through the parts of the
+# cv2.VideoCapture interface that Camera uses
+class ImageDirectorySource():
+    extensions = ('.bmp', '.jpeg', '.jpg', '.pgm', '.png', '.ppm', '.tif', '.tiff')
+
+    def __init__(self, path):
+        self.paths = [os.path.join(path, name) for name in sorted(os.listdir(path))
+                      if os.path.splitext(name)[1].lower() in self.extensions]
+        self.position = 0
+        self.grabbed = None
+
+    def isOpened(self):
+        return len(self.paths) > 0
+
+    def set(self, prop, value):
+        return False  # images are used at their own size (Camera resizes them if needed)
+
+    def grab(self):
+        if self.position >= len(self.paths):
+            return False
+        self.grabbed = self.paths[self.position]
+        self.position += 1
+        return True
+
+    def retrieve(self, image=None, channel=0):
+        frame = cv2.imread(self.grabbed)
+        return frame is not None, frame
+
+    def release(self):
+        pass
+
+# opens a camera given its number, or a recorded video file or image directory given its path;
+# returns the source, and whether it is a live camera
+def open_source(name):
+    if name.isdigit():
+        return cv2.VideoCapture(int(name)), True
+    if os.path.isdir(name):
+        return ImageDirectorySource(name), False
+    return cv2.VideoCapture(name), False
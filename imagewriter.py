@@ -0,0 +1,93 @@
+import os
+import re
+import threading
+import Queue
+import cv2
+from metrics import metrics, clock
+
+# Numbers the images saved in a directory as <prefix><N>.jpg, carrying on after the highest number
+# already there. The directory is listed once, up front, instead of probing for a free name per image.
+class FileSequence():
+    def __init__(self, directory, prefixes):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        pattern = re.compile('^(' + '|'.join(map(re.escape, prefixes)) + r')(\d+)\.')
+        numbers = [int(match.group(2)) for match in map(pattern.match, os.listdir(directory)) if match]
+        self.count = max(numbers) + 1 if numbers else 0
+
+    def next(self):
+        number = self.count
+        self.count += 1
+        return number
+
+    def path(self, prefix, number, extension='.jpg'):
+        return os.path.join(self.directory, prefix + str(number) + extension)
+
+# Encodes and writes images on a background thread, so that JPEG encoding and disk writes stay off
+# the detection path. Images that may be dropped (e.g. training photos) are, when more than
+# max_queue images are already waiting; the rest (e.g. killcam shots) are always written. Other
+# ways of storing images (see TrainingStore) can run on the same thread with submit().
+class ImageWriter():
+    def __init__(self, quality=95, max_queue=8, stats=metrics):
+        self.quality = quality  # JPEG quality, 0-100
+        self.stats = stats      # where to record metrics (see Metrics.scoped())
+        self.max_queue = max_queue
+        self.queue = Queue.Queue()
+        self.written = 0
+        self.dropped = 0
+        self.stats.gauge('images.queued', self.queue.qsize)
+        self.stats.gauge('images.written', lambda: self.written)
+        self.stats.gauge('images.dropped', lambda: self.dropped)
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # queues a copy of img (frames are reused buffers) to be written to path; returns False if dropped
+    def write(self, path, img, droppable=True):
+        if not self.accepts(droppable):
+            return False
+        self.queue.put((self.write_file, (path, img.copy())))
+        return True
+
+    # queues a call of function(*args) on the writer thread; returns False if dropped
+    def submit(self, function, args, droppable=True):
+        if not self.accepts(droppable):
+            return False
+        self.queue.put((function, args))
+        return True
+
+    # whether an image would be queued now rather than dropped (in which case it counts as dropped),
+    # so that callers can check before doing the work of preparing it
+    def accepts(self, droppable=True):
+        if droppable and self.queue.qsize() >= self.max_queue:
+            self.dropped += 1
+            return False
+        return True
+
+    # writes out everything still queued, then stops the thread
+    def dispose(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            function, args = item
+            start = clock()
+            try:
+                if function(*args):
+                    self.written += 1
+            except (cv2.error, IOError, OSError), e:
+                print 'Could not save image: ' + str(e)
+            self.stats.record_since('images.write', start)
+
+    # returns whether the image was written
+    def write_file(self, path, img):
+        if not cv2.imwrite(path, img, [cv2.cv.CV_IMWRITE_JPEG_QUALITY, self.quality]):
+            print 'Could not write image ' + path
+            return False
+        return True
@@ -0,0 +1,144 @@
+import array
+import json
+import socket
+import threading
+import time
+import timeit
+
+# highest resolution wall clock available (time.perf_counter does not exist in Python 2)
+clock = timeit.default_timer
+
+# Keeps the most recent samples of one measurement in a preallocated array, so that recording
+# a sample is just a store and an increment. Percentiles are only computed when reporting.
+class Histogram():
+    def __init__(self, size=1024):
+        self.size = size
+        self.samples = array.array('d', [0.0]) * size
+        self.count = 0  # total number of samples ever recorded
+
+    def record(self, value):
+        self.samples[self.count % self.size] = value
+        self.count += 1
+
+    def summary(self):
+        values = sorted(self.samples[:min(self.count, self.size)])
+        if not values:
+            return {'count': 0}
+
+        def percentile(fraction):
+            return values[min(len(values) - 1, int(fraction * len(values)))]
+
+        return {'count': self.count,
+                'mean': sum(values) / len(values),
+                'p50': percentile(.50),
+                'p95': percentile(.95),
+                'p99': percentile(.99),
+                'max': values[-1]}
+
+# A set of named histograms of durations (in seconds) and of gauges (callables that are only
+# read when reporting), plus an optional background reporter that periodically writes their
+# summaries to a file, a local UDP socket and/or stdout
+class Metrics():
+    def __init__(self):
+        self.histograms = {}
+        self.gauges = {}
+        self.reporter = None
+        self.stop_event = threading.Event()
+
+    def histogram(self, name):
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms.setdefault(name, Histogram())
+        return hist
+
+    def record(self, name, seconds):
+        self.histogram(name).record(seconds)
+
+    # records the time since start (a value previously returned by clock())
+    def record_since(self, name, start):
+        self.histogram(name).record(clock() - start)
+
+    # registers a callable returning the current value of something, e.g. a frame counter
+    def gauge(self, name, read):
+        self.gauges[name] = read
+
+    # the same metrics, with names prefixed (e.g. 'stream1.'), for one of several things that
+    # record the same metrics in one process
+    def scoped(self, prefix):
+        return MetricsScope(self, prefix) if prefix else self
+
+    def summary(self):
+        return dict((name, hist.summary()) for name, hist in self.histograms.items())
+
+    def gauge_values(self):
+        return dict((name, read()) for name, read in self.gauges.items())
+
+    # starts a thread that reports every interval seconds: appended as a line of JSON to path,
+    # sent as a JSON datagram to localhost:port, and printed as a table if verbose is set
+    def start_reporting(self, interval, path=None, port=None, verbose=False):
+        if not (path or port or verbose):
+            return
+        self.reporter = threading.Thread(target=self.report_loop, args=(interval, path, port, verbose))
+        self.reporter.daemon = True
+        self.reporter.start()
+
+    def stop_reporting(self):
+        self.stop_event.set()
+        if self.reporter:
+            self.reporter.join()
+
+    def report_loop(self, interval, path, port, verbose):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if port else None
+        while not self.stop_event.wait(interval):
+            summary = self.summary()
+            gauges = self.gauge_values()
+            line = json.dumps({'time': time.time(), 'metrics': summary, 'gauges': gauges}, sort_keys=True)
+            if path:
+                with open(path, 'a') as f:
+                    f.write(line + '\n')
+            if sock:
+                try:
+                    sock.sendto(line, ('127.0.0.1', port))
+                except socket.error:
+                    pass  # nobody listening is not an error
+            if verbose:
+                self.print_summary(summary, gauges)
+
+    def print_summary(self, summary, gauges):
+        print '%-28s %8s %9s %9s %9s %9s' % ('timing (ms)', 'count', 'p50', 'p95', 'p99', 'max')
+        for name in sorted(summary):
+            stats = summary[name]
+            if stats['count']:
+                print '%-28s %8d %9.2f %9.2f %9.2f %9.2f' % (name, stats['count'], 1000 * stats['p50'],
+                                                             1000 * stats['p95'], 1000 * stats['p99'],
+                                                             1000 * stats['max'])
+        for name in sorted(gauges):
+            print '%-28s %8s' % (name, gauges[name])
+
+    # prints, on one line, how long each part of startup (the 'startup.' timings) took
+    def print_startup_report(self):
+        prefix = 'startup.'
+        timings = sorted((name[len(prefix):], hist.samples[0]) for name, hist in self.histograms.items()
+                         if name.startswith(prefix) and hist.count)
+        print 'Startup (ms): ' + ', '.join('%s %.0f' % (name, 1000 * seconds) for name, seconds in timings)
+
+# records to a Metrics under prefixed names (see Metrics.scoped())
+class MetricsScope():
+    def __init__(self, metrics, prefix):
+        self.metrics = metrics
+        self.prefix = prefix
+
+    def record(self, name, seconds):
+        self.metrics.record(self.prefix + name, seconds)
+
+    def record_since(self, name, start):
+        self.metrics.record_since(self.prefix + name, start)
+
+    def gauge(self, name, read):
+        self.metrics.gauge(self.prefix + name, read)
+
+    def scoped(self, prefix):
+        return self.metrics.scoped(self.prefix + prefix)
+
+# shared by the whole process
+metrics = Metrics()
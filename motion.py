@@ -0,0 +1,54 @@
+import cv2
+import numpy
+from metrics import metrics, clock
+
+# A cheap check, run before face detection, for where anything in view has changed. Frames are
+# shrunk to a thumbnail a few dozen pixels wide and compared with a running average of the previous
+# ones, which costs a small fraction of a cascade pass.
+class MotionGate():
+    def __init__(self, width=64, alpha=.05, threshold=20, min_area=.002, pan_area=.5, margin=.25):
+        self.width = width          # thumbnail width in pixels
+        self.alpha = alpha          # how quickly the background adapts to changes that stay
+        self.threshold = threshold  # gray level difference at which a thumbnail pixel counts as changed
+        self.min_area = min_area    # fraction of the thumbnail that must change to count as motion
+        self.pan_area = pan_area    # above this fraction, the camera itself moved: start afresh
+        self.margin = margin        # padding around changed areas, as a fraction of their size
+        self.background = None      # running average of the thumbnails, as float32
+
+    # takes a grayscale frame and returns an [x, y, w, h] box (in its coordinates) around everything
+    # that changed since the previous frames, or None if nothing did
+    def update(self, img):
+        start = clock()
+        img_h, img_w = img.shape[:2]
+        small_h = max(1, int(round(img_h * self.width / float(img_w))))
+        small = cv2.resize(img, (self.width, small_h), interpolation=cv2.INTER_AREA)
+        small = cv2.GaussianBlur(small, (5, 5), 0)  # keeps sensor noise from counting as motion
+
+        if self.background is None or self.background.shape != small.shape:
+            self.background = small.astype(numpy.float32)
+            metrics.record_since('detect.motion', start)
+            return [0, 0, img_w, img_h]  # nothing to compare with yet
+
+        changed = cv2.absdiff(small, cv2.convertScaleAbs(self.background)) > self.threshold
+        fraction = numpy.count_nonzero(changed) / float(changed.size)
+        if fraction > self.pan_area:
+            # most of the view changed at once: the turret moved or the lights changed, and the old
+            # background would only show up as motion everywhere for a long time
+            self.background = small.astype(numpy.float32)
+        else:
+            cv2.accumulateWeighted(small, self.background, self.alpha)
+        metrics.record_since('detect.motion', start)
+
+        if fraction > self.pan_area:
+            return [0, 0, img_w, img_h]
+        if fraction < self.min_area:
+            return None
+
+        # bounding box of the changed pixels, padded and scaled back up to the frame's size
+        ys, xs = numpy.nonzero(changed)
+        x0, x1, y0, y1 = xs.min(), xs.max() + 1, ys.min(), ys.max() + 1
+        pad_x, pad_y = (x1 - x0) * self.margin, (y1 - y0) * self.margin
+        scale = float(img_w) / self.width
+        x0, x1 = max(0, int((x0 - pad_x) * scale)), min(img_w, int((x1 + pad_x) * scale))
+        y0, y1 = max(0, int((y0 - pad_y) * scale)), min(img_h, int((y1 + pad_y) * scale))
+        return [x0, y0, x1 - x0, y1 - y0]
@@ -0,0 +1,38 @@
+import numpy
+
+# Greedy non-maximum suppression over an (N, 4) array of [x, y, w, h] boxes: keeps the highest scoring
+# box of every group that overlaps by more than threshold (intersection over union), and returns the
+# indices of the boxes kept, best first. Ties keep the earlier box.
+def non_max_suppression(boxes, scores, threshold=.3):
+    if len(boxes) == 0:
+        return numpy.zeros(0, dtype=int)
+    x0 = boxes[:, 0].astype(float)
+    y0 = boxes[:, 1].astype(float)
+    x1 = x0 + boxes[:, 2]
+    y1 = y0 + boxes[:, 3]
+    areas = (x1 - x0) * (y1 - y0)
+
+    order = numpy.argsort(-numpy.asarray(scores, dtype=float), kind='mergesort')
+    keep = []
+    while order.size:
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        w = numpy.maximum(0, numpy.minimum(x1[best], x1[rest]) - numpy.maximum(x0[best], x0[rest]))
+        h = numpy.maximum(0, numpy.minimum(y1[best], y1[rest]) - numpy.maximum(y0[best], y0[rest]))
+        intersection = w * h
+        overlap = intersection / (areas[best] + areas[rest] - intersection)
+        order = rest[overlap <= threshold]
+    return numpy.array(keep, dtype=int)
+
+# Merges the faces found by several cascade passes over the same image, given as (faces, weights)
+# pairs, so that a face found by more than one pass (e.g. frontal and profile) is only kept once, from
+# the pass most confident about it. Returns the merged (N, 4) array, and the index of the pass that
+# each of its faces came from.
+def merge_passes(passes, threshold=.3):
+    # (list comprehensions leak their variables, so these must not reuse the names assigned here)
+    faces = numpy.concatenate([pass_faces for pass_faces, pass_weights in passes])
+    weights = numpy.concatenate([pass_weights for pass_faces, pass_weights in passes])
+    sources = numpy.concatenate([numpy.repeat(i, len(pass_faces))
+                                 for i, (pass_faces, pass_weights) in enumerate(passes)])
+    keep = non_max_suppression(faces, weights, threshold)
+    return faces[keep], sources[keep]
@@ -0,0 +1,151 @@
+import os
+from optparse import OptionParser
+
+# http://stackoverflow.com/questions/4984647/accessing-dict-keys-like-an-attribute-in-python
+class AttributeDict(dict):
+    __getattr__ = dict.__getitem__
+    __setattr__ = dict.__setitem__
+
+# command-line options shared by sentinel.py and the other entry points
+def build_parser(usage=None):
+    parser = OptionParser(usage=usage)
+    parser.add_option("-l", "--launcher", dest="launcherID", default="2123",
+                      help="specify VendorID of the missile launcher to use, or 'sim' for a simulated launcher. "
+                           "Default: '2123' (dreamcheeky thunder)",
+                      metavar="LAUNCHER")
+    parser.add_option("--usb-coalesce", dest="usb_coalesce", default=0.0, type="float",
+                      help="hold back turret direction changes for this many milliseconds, so that rapid changes "
+                           "are sent as one. Default: 0",
+                      metavar="MS")
+    parser.add_option("--usb-timeout", dest="usb_timeout", default=250, type="int",
+                      help="timeout for each USB transfer to the launcher, in milliseconds. Default: 250",
+                      metavar="MS")
+    parser.add_option("--sim-latency", dest="sim_latency", default=0.0, type="float",
+                      help="milliseconds of latency added to every command of the simulated launcher. Default: 0",
+                      metavar="MS")
+    parser.add_option("-d", "--disarm", action="store_false", dest="armed", default=True,
+                      help="track faces but do not fire any missiles")
+    parser.add_option("-r", "--reset", action="store_true", dest="reset_only", default=False,
+                      help="reset the turret position and exit")
+    parser.add_option("--nd", "--no-display", action="store_true", dest="no_display", default=False,
+                      help="do not display captured images")
+    parser.add_option("-c", "--camera", dest="camera", default='0',
+                      help="specify the camera # to use, or a video file or directory of images to replay. "
+                           "Default: 0", metavar="NUM")
+    parser.add_option("-s", "--size", dest="image_dimensions", default='320x240',
+                      help="image dimensions (recommended: 320x240 or 640x480). Default: 320x240",
+                      metavar="WIDTHxHEIGHT")
+    parser.add_option("-v", "--verbose", action="store_true", dest="verbose", default=False,
+                      help="detailed output, including timing information")
+    parser.add_option("-m", "--mode", dest="mode", default="follow",
+                      help="choose behaviour of sentry. options (follow, sweep, scan, guard) default:follow", metavar="NUM")
+    parser.add_option("-o", "--origin", dest="origin", default="0.5,0.5",
+                      help="direction to point initially - an x and y decimal percentage. Default: 0.5,0.5",
+                      metavar="X,Y")
+    parser.add_option("-p", "--profile", action="store_true", dest="profile", default=False,
+                      help="enable detection of facial side views - better detection, slower on single-core machines")
+    parser.add_option("--calibration", dest="calibration",
+                      default=os.path.join(os.path.expanduser('~'), '.config', 'sentinel'),
+                      help="directory of the launchers' calibration profiles, as saved by calibrate.py; "
+                           "empty to use the built-in speeds. Default: ~/.config/sentinel",
+                      metavar="DIR")
+    parser.add_option("--rehome-interval", dest="rehome_interval", default=600.0, type="float",
+                      help="when centering, drive against the end stops to find the turret's position afresh "
+                           "at most this often (0 to always do so); otherwise it is estimated. Default: 600",
+                      metavar="SECONDS")
+    parser.add_option("--rehome-error", dest="rehome_error", default=0.15, type="float",
+                      help="also re-home once the position estimate may be off by more than this fraction "
+                           "of the turret's range. Default: 0.15",
+                      metavar="FRACTION")
+    parser.add_option("--control", dest="control", default="step", type="choice",
+                      choices=["step", "continuous"],
+                      help="how to steer towards a target: 'step' (a timed move, then stop and settle) or "
+                           "'continuous' (closed-loop, every frame, leading moving targets). Default: step",
+                      metavar="MODE")
+    parser.add_option("-t", "--track", action="store_true", dest="roi_tracking", default=False,
+                      help="after a face is found, only search near its last position until it is lost")
+    parser.add_option("--track-misses", dest="track_misses", default=3, type="int",
+                      help="frames a tracked face may be missed before scanning the full frame again. Default: 3",
+                      metavar="NUM")
+    parser.add_option("--reacquire", dest="reacquire_interval", default=30, type="int",
+                      help="while tracking, scan the full frame every NUM frames anyway. Default: 30",
+                      metavar="NUM")
+    parser.add_option("--motion-gate", action="store_true", dest="motion_gate", default=False,
+                      help="while no face is being followed, only search the parts of the frame where "
+                           "something has moved, and skip frames in which nothing has")
+    parser.add_option("--motion-rescan", dest="motion_rescan", default=30, type="int",
+                      help="with --motion-gate, scan the full frame every NUM frames anyway, in case "
+                           "somebody is standing still. Default: 30",
+                      metavar="NUM")
+    parser.add_option("--detect-every", dest="detect_every", default=1, type="int",
+                      help="while following a face, only run detection on every NUM-th frame and predict "
+                           "where faces are in between. Default: 1",
+                      metavar="NUM")
+    parser.add_option("--detect-scale", dest="detect_scale", default=1.0, type="float",
+                      help="run face detection on images downscaled by this factor (e.g. 0.5), "
+                           "keeping full size for display and killcam. Default: 1",
+                      metavar="SCALE")
+    parser.add_option("--target-fps", dest="target_fps", default=None, type="float",
+                      help="keep face detection fast enough for this many frames a second, by adjusting the "
+                           "detection resolution, scale steps, smallest face size, profile passes and "
+                           "--detect-every to the measured cost of each frame (starting from the options given)",
+                      metavar="FPS")
+    parser.add_option("--min-neighbors", dest="min_neighbors", default=4, type="int",
+                      help="overlapping detections a face needs to count as one; higher finds fewer faces "
+                           "but fewer false ones. Default: 4",
+                      metavar="NUM")
+    parser.add_option("--lazy-decode", action="store_true", dest="lazy_decode", default=False,
+                      help="only decode camera frames when the tracking loop is ready for one. "
+                           "Saves CPU when detection is slower than the camera, at up to a frame of extra latency")
+    parser.add_option("--training-rate", dest="training_rate", default=1.0, type="float",
+                      help="save the target's face for training at most this many times a second; 0 to "
+                           "save none. Default: 1",
+                      metavar="PER_SECOND")
+    parser.add_option("--training-dedup", dest="training_dedup", default=6, type="int",
+                      help="skip training faces whose 64-bit perceptual hash is at most this many bits "
+                           "from one saved recently. Default: 6",
+                      metavar="BITS")
+    parser.add_option("--jpeg-quality", dest="jpeg_quality", default=95, type="int",
+                      help="JPEG quality (0-100) of killcam shots and training faces. Default: 95",
+                      metavar="NUM")
+    parser.add_option("--image-queue", dest="image_queue", default=8, type="int",
+                      help="training faces waiting to be written beyond which new ones are dropped. Default: 8",
+                      metavar="NUM")
+    parser.add_option("--preview", dest="preview_port", default=None, type="int",
+                      help="serve the annotated camera images as an MJPEG stream at http://localhost:PORT/ "
+                           "(encoded only while watched)",
+                      metavar="PORT")
+    parser.add_option("--preview-fps", dest="preview_fps", default=10.0, type="float",
+                      help="highest frame rate of the preview stream. Default: 10",
+                      metavar="FPS")
+    parser.add_option("--metrics-file", dest="metrics_file", default=None,
+                      help="periodically append timing metrics to this file, as one line of JSON per report",
+                      metavar="FILE")
+    parser.add_option("--metrics-port", dest="metrics_port", default=None, type="int",
+                      help="periodically send timing metrics as JSON datagrams to this UDP port on localhost",
+                      metavar="PORT")
+    parser.add_option("--metrics-interval", dest="metrics_interval", default=5.0, type="float",
+                      help="seconds between metrics reports (also printed with --verbose). Default: 5",
+                      metavar="SECONDS")
+    return parser
+
+# parses the command line, returning the options as an AttributeDict (so that extra options can
+# be added to it) along with the remaining arguments
+def parse_options(parser, args=None):
+    opts, args = parser.parse_args(args)
+    if not 0 < opts.detect_scale <= 1:
+        parser.error("--detect-scale must be greater than 0 and at most 1")
+    if opts.detect_every < 1:
+        parser.error("--detect-every must be at least 1")
+    if opts.motion_rescan < 1:
+        parser.error("--motion-rescan must be at least 1")
+    if opts.target_fps is not None and opts.target_fps <= 0:
+        parser.error("--target-fps must be greater than 0")
+
+    # additional options
+    opts = AttributeDict(vars(opts))
+    opts.haar_file = 'haarcascade_frontalface_default.xml'
+    opts.haar_profile_file = 'haarcascade_profileface.xml'
+    opts.launcher_index = 0  # which of several attached launchers of the same model to use
+    opts.metrics_prefix = ''  # prepended to the names of a turret's metrics
+    return opts, args
@@ -0,0 +1,164 @@
+import BaseHTTPServer
+import SocketServer
+import socket
+import threading
+import time
+import cv2
+from metrics import metrics, clock
+
+BOUNDARY = 'sentinelframe'
+
+class PreviewHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+# Serves the stream: / (or /stream.mjpg) as MJPEG, for browsers and video players, and
+# /snapshot.jpg as the latest single frame
+class PreviewHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        preview = self.server.preview
+        if self.path in ('/', '/stream.mjpg'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=' + BOUNDARY)
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            seq = preview.client_connected()
+            try:
+                while True:
+                    seq, jpeg = preview.next_jpeg(seq)
+                    if jpeg is None:
+                        return
+                    self.wfile.write('--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n'
+                                     % (BOUNDARY, len(jpeg)))
+                    self.wfile.write(jpeg)
+                    self.wfile.write('\r\n')
+                    self.wfile.flush()
+            finally:
+                preview.client_disconnected()
+        elif self.path == '/snapshot.jpg':
+            seq = preview.client_connected()
+            try:
+                seq, jpeg = preview.next_jpeg(seq)
+            finally:
+                preview.client_disconnected()
+            if jpeg is None:
+                self.send_error(503)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(jpeg)))
+            self.end_headers()
+            self.wfile.write(jpeg)
+        else:
+            self.send_error(404)
+
+    # clients go away by closing the connection, which is no reason for a traceback
+    def handle(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+        except socket.error:
+            pass
+
+    def finish(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+        except socket.error:
+            pass
+
+    def log_message(self, format, *args):
+        pass  # no line per request on the console
+
+# A preview of the annotated camera images for headless turrets, served over HTTP as MJPEG. Frames
+# are only wanted while somebody is watching, at most max_fps times a second, and are rendered and
+# JPEG-encoded on a thread of the server's.
+class PreviewServer():
+    def __init__(self, port, host='127.0.0.1', max_fps=10.0, quality=80):
+        self.interval = 1.0 / max_fps
+        self.quality = quality  # JPEG quality, 0-100
+
+        self.condition = threading.Condition()
+        self.clients = 0
+        self.frame = None       # function rendering the latest frame published, not yet encoded
+        self.jpeg = None        # latest encoded frame, and its number
+        self.jpeg_seq = 0
+        self.last_published = 0
+        self.running = True
+        metrics.gauge('preview.clients', lambda: self.clients)
+
+        self.server = PreviewHTTPServer((host, port), PreviewHandler)
+        self.server.preview = self
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.encoder = threading.Thread(target=self.encode_frames)
+        self.encoder.daemon = True
+        self.encoder.start()
+        print 'Preview at http://%s:%d/' % (host, port)
+
+    # True if a frame is due: somebody is watching, and the last one was published long enough ago
+    def wants_frame(self):
+        return self.clients > 0 and time.time() - self.last_published >= self.interval
+
+    # hands over a frame, as a function returning the image (called on the encoding thread, so it
+    # must not refer to buffers that the caller reuses)
+    def publish(self, render):
+        self.last_published = time.time()
+        self.condition.acquire()
+        self.frame = render
+        self.condition.notify_all()
+        self.condition.release()
+
+    # returns the number of the latest encoded frame, which may be from before anybody was watching:
+    # the client is sent the frames after it, rendered now that frames are wanted again
+    def client_connected(self):
+        self.condition.acquire()
+        self.clients += 1
+        seq = self.jpeg_seq
+        self.condition.release()
+        return seq
+
+    def client_disconnected(self):
+        self.condition.acquire()
+        self.clients -= 1
+        self.condition.release()
+
+    # blocks until there is an encoded frame newer than seq, and returns its number and JPEG data
+    # (None once the server is shutting down)
+    def next_jpeg(self, seq):
+        self.condition.acquire()
+        while self.running and self.jpeg_seq <= seq:
+            self.condition.wait()
+        seq, jpeg = self.jpeg_seq, self.jpeg if self.running else None
+        self.condition.release()
+        return seq, jpeg
+
+    def dispose(self):
+        self.condition.acquire()
+        self.running = False
+        self.condition.notify_all()
+        self.condition.release()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def encode_frames(self):
+        while True:
+            self.condition.acquire()
+            while self.running and self.frame is None:
+                self.condition.wait()
+            if not self.running:
+                self.condition.release()
+                return
+            render, self.frame = self.frame, None
+            self.condition.release()
+
+            frame = render()
+            start = clock()
+            retval, data = cv2.imencode('.jpg', frame, [cv2.cv.CV_IMWRITE_JPEG_QUALITY, self.quality])
+            metrics.record_since('preview.encode', start)
+            if not retval:
+                continue
+            self.condition.acquire()
+            self.jpeg = data.tostring()
+            self.jpeg_seq += 1
+            self.condition.notify_all()
+            self.condition.release()
@@ -0,0 +1,73 @@
+import time
+from metrics import metrics
+
+# Detector settings from the configured ones down to ones many times cheaper, one change at a time:
+# detecting less often while following a face, coarser scale steps, no profile passes, larger
+# smallest faces and lower detection resolution. Changes that would not make the settings any
+# cheaper than they already are are skipped, e.g. leaving out profile passes that aren't configured,
+# or a smallest face (for images img_h pixels high) no larger than the cascades' own window.
+def ladder(settings, img_h, window=24):
+    steps = [('detect_every', 2), ('scale_factor', 1.2), ('profile', False), ('min_size', .15),
+             ('scale', settings['scale'] * .75), ('detect_every', 3), ('scale_factor', 1.3),
+             ('scale', settings['scale'] * .5), ('min_size', .25), ('detect_every', 4)]
+    levels = [dict(settings)]
+    for name, value in steps:
+        current = levels[-1][name]
+        if name == 'min_size':
+            # in pixels of the detection image, as detectMultiScale takes it
+            pixels = lambda fraction: int(round(img_h * levels[-1]['scale'] * fraction))
+            cheaper = pixels(value) > max(pixels(current), window)
+        elif name in ('scale', 'profile'):
+            cheaper = value < current
+        else:
+            cheaper = value > current
+        if cheaper:
+            level = dict(levels[-1])
+            level[name] = value
+            levels.append(level)
+    return levels
+
+# Keeps the tracking loop at a target frame rate on machines of any speed, by trading detection for
+# time. What handling every frame costs is measured (everything the loop does with it, from picking
+# it up to being done with it, but not waiting for the camera to deliver it), and whenever its
+# average over a window of frames is over budget the next cheaper settings of the ladder are used;
+# once it is well within budget, the previous ones again, unless they were found to be over budget
+# within the last memory seconds.
+#
+# Settings are a dict of: scale (of the detection image, as --detect-scale), scale_factor (of
+# detectMultiScale), min_size (smallest face, as a fraction of the image height), profile
+# (whether profile passes run) and detect_every (as --detect-every).
+class FrameBudget():
+    def __init__(self, target_fps, settings, img_h, window=15, headroom=.7, memory=60):
+        self.budget = 1.0 / target_fps  # seconds of processing per frame
+        self.window = window            # frames averaged before deciding on a change
+        self.headroom = headroom        # fraction of the budget under which to try better settings
+        self.memory = memory
+        self.levels = ladder(settings, img_h)
+        self.level = 0
+        self.costs = []
+        self.over_budget = {}  # level: when it was last found to be over budget
+        metrics.gauge('budget.level', lambda: self.level)
+
+    def settings(self):
+        return self.levels[self.level]
+
+    # records what processing a frame cost, in seconds; returns True if the settings changed
+    def record(self, cost):
+        self.costs.append(cost)
+        if len(self.costs) < self.window:
+            return False
+        average = sum(self.costs) / len(self.costs)
+        self.costs = []
+        metrics.record('budget.cost', average)
+
+        now = time.time()
+        if average > self.budget and self.level < len(self.levels) - 1:
+            self.over_budget[self.level] = now
+            self.level += 1
+            return True
+        if (average < self.headroom * self.budget and self.level > 0 and
+                now - self.over_budget.get(self.level - 1, 0) > self.memory):
+            self.level -= 1
+            return True
+        return False
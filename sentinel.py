@@ -10,72 +10,136 @@
 #
 # Options:
 # -h, --help            show this help message and exit
-# -l ID, --launcher=ID  specify VendorID of the missile launcher to use.
-#                         Default: '2123' (dreamcheeky thunder)
+# -l ID, --launcher=ID  specify VendorID of the missile launcher to use, or 'sim'
+#                         for a simulated launcher. Default: '2123' (dreamcheeky thunder)
+#   --usb-coalesce=MS     hold back turret direction changes for this many
+#                         milliseconds, so that rapid changes are sent as one.
+#                         Default: 0
+#   --usb-timeout=MS      timeout for each USB transfer to the launcher, in
+#                         milliseconds. Default: 250
+#   --sim-latency=MS      milliseconds of latency added to every command of the
+#                         simulated launcher. Default: 0
 #   -d, --disarm          track faces but do not fire any missiles
 #   -r, --reset           reset the turret position and exit
 #   --nd, --no-display    do not display captured images
-#   -c NUM, --camera=NUM  specify the camera # to use. Default: 0
+#   -c NUM, --camera=NUM  specify the camera # to use, or a video file or directory
+#                         of images to replay. Default: 0
 #   -s WIDTHxHEIGHT, --size=WIDTHxHEIGHT
 #                         image dimensions (recommended: 320x240 or 640x480).
 #                         Default: 320x240
 #   -v, --verbose         detailed output, including timing information
+#   --calibration=DIR     directory of the launchers' calibration profiles, as saved
+#                         by calibrate.py; empty to use the built-in speeds.
+#                         Default: ~/.config/sentinel
+#   --rehome-interval=SECONDS
+#                         when centering, drive against the end stops to find the
+#                         turret's position afresh at most this often (0 to always
+#                         do so); otherwise it is estimated. Default: 600
+#   --rehome-error=FRACTION
+#                         also re-home once the position estimate may be off by
+#                         more than this fraction of the turret's range. Default: 0.15
+#   --control=MODE        how to steer towards a target: 'step' (a timed move,
+#                         then stop and settle) or 'continuous' (closed-loop,
+#                         every frame, leading moving targets). Default: step
+#   -t, --track           after a face is found, only search near its last position
+#                         until it is lost
+#   --track-misses=NUM    frames a tracked face may be missed before scanning the
+#                         full frame again. Default: 3
+#   --reacquire=NUM       while tracking, scan the full frame every NUM frames
+#                         anyway. Default: 30
+#   --motion-gate         while no face is being followed, only search the parts of
+#                         the frame where something has moved, and skip frames in
+#                         which nothing has
+#   --motion-rescan=NUM   with --motion-gate, scan the full frame every NUM frames
+#                         anyway, in case somebody is standing still. Default: 30
+#   --detect-every=NUM    while following a face, only run detection on every
+#                         NUM-th frame and predict where faces are in between.
+#                         Default: 1
+#   --detect-scale=SCALE  run face detection on images downscaled by this factor
+#                         (e.g. 0.5), keeping full size for display and killcam.
+#                         Default: 1
+#   --target-fps=FPS      keep face detection fast enough for this many frames a
+#                         second, by adjusting the detection resolution, scale
+#                         steps, smallest face size, profile passes and
+#                         --detect-every to the measured cost of each frame
+#                         (starting from the options given)
+#   --min-neighbors=NUM   overlapping detections a face needs to count as one;
+#                         higher finds fewer faces but fewer false ones. Default: 4
+#   --lazy-decode         only decode camera frames when the tracking loop is
+#                         ready for one. Saves CPU when detection is slower than
+#                         the camera, at up to a frame of extra latency
+#   --training-rate=PER_SECOND
+#                         save the target's face for training at most this many
+#                         times a second; 0 to save none. Default: 1
+#   --training-dedup=BITS skip training faces whose 64-bit perceptual hash is at
+#                         most this many bits from one saved recently. Default: 6
+#   --jpeg-quality=NUM    JPEG quality (0-100) of killcam shots and training faces.
+#                         Default: 95
+#   --image-queue=NUM     training faces waiting to be written beyond which new
+#                         ones are dropped. Default: 8
+#   --preview=PORT        serve the annotated camera images as an MJPEG stream at
+#                         http://localhost:PORT/ (encoded only while watched)
+#   --preview-fps=FPS     highest frame rate of the preview stream. Default: 10
+#   --metrics-file=FILE   periodically append timing metrics to this file, as one
+#                         line of JSON per report
+#   --metrics-port=PORT   periodically send timing metrics as JSON datagrams to
+#                         this UDP port on localhost
+#   --metrics-interval=SECONDS
+#                         seconds between metrics reports (also printed with
+#                         --verbose). Default: 5
 
 import os
 import sys
 import threading
 import time
-from optparse import OptionParser
 from turret import Turret
 from camera import Camera
-
-# http://stackoverflow.com/questions/4984647/accessing-dict-keys-like-an-attribute-in-python
-class AttributeDict(dict):
-    __getattr__ = dict.__getitem__
-    __setattr__ = dict.__setitem__
+from controller import TrackingController
+from options import build_parser, parse_options
+from metrics import metrics, clock
+from preview import PreviewServer
 
 if __name__ == '__main__':
-    if (sys.platform == 'linux2' or sys.platform == 'darwin') and not os.geteuid() == 0:
-        sys.exit("Script must be run as root.")
-
     # command-line options
-    parser = OptionParser()
-    parser.add_option("-l", "--launcher", dest="launcherID", default="2123",
-                      help="specify VendorID of the missile launcher to use. Default: '2123' (dreamcheeky thunder)",
-                      metavar="LAUNCHER")
-    parser.add_option("-d", "--disarm", action="store_false", dest="armed", default=True,
-                      help="track faces but do not fire any missiles")
-    parser.add_option("-r", "--reset", action="store_true", dest="reset_only", default=False,
-                      help="reset the turret position and exit")
-    parser.add_option("--nd", "--no-display", action="store_true", dest="no_display", default=False,
-                      help="do not display captured images")
-    parser.add_option("-c", "--camera", dest="camera", default='0',
-                      help="specify the camera # to use. Default: 0", metavar="NUM")
-    parser.add_option("-s", "--size", dest="image_dimensions", default='320x240',
-                      help="image dimensions (recommended: 320x240 or 640x480). Default: 320x240",
-                      metavar="WIDTHxHEIGHT")
-    parser.add_option("-v", "--verbose", action="store_true", dest="verbose", default=False,
-                      help="detailed output, including timing information")
-    parser.add_option("-m", "--mode", dest="mode", default="follow",
-                      help="choose behaviour of sentry. options (follow, sweep, guard) default:follow", metavar="NUM")
-    parser.add_option("-o", "--origin", dest="origin", default="0.5,0.5",
-                      help="direction to point initially - an x and y decimal percentage. Default: 0.5,0.5",
-                      metavar="X,Y")
-    parser.add_option("-p", "--profile", action="store_true", dest="profile", default=False,
-                      help="enable detection of facial side views - better detection but slower")
-
-    opts, args = parser.parse_args()
+    parser = build_parser()
+    opts, args = parse_options(parser)
     print opts
 
-    # additional options
-    opts = AttributeDict(vars(opts))  # converting opts to an AttributeDict so we can add extra options
-    opts.haar_file = 'haarcascade_frontalface_default.xml'
-    opts.haar_profile_file = 'haarcascade_profileface.xml'
+    # root is needed to talk to the USB launcher, but not to the simulated one
+    if (sys.platform == 'linux2' or sys.platform == 'darwin') and not os.geteuid() == 0 and opts.launcherID != 'sim':
+        sys.exit("Script must be run as root.")
 
-    turret = Turret(opts)
+    # the launcher is found and set up on a thread of its own, while the camera is opened and the
+    # cascades are loaded
+    startup_time = clock()
+    turret_setup = {}
+    def setup_turret():
+        start = clock()
+        try:
+            turret_setup['turret'] = Turret(opts)
+        except Exception, ex:
+            turret_setup['error'] = ex  # re-raised once the camera is set up too
+        metrics.record_since('startup.turret', start)
+    turret_thread = threading.Thread(target=setup_turret)
+    turret_thread.start()
+
+    start = clock()
     camera = Camera(opts)
+    metrics.record_since('startup.camera', start)
+    turret_thread.join()
+    if 'error' in turret_setup:
+        camera.dispose()
+        raise turret_setup['error']
+    turret = turret_setup['turret']
     turretCentered = True
 
+    # with --control=continuous, a closed-loop controller steers the turret on every frame
+    # instead of a timed adjust() after each detection
+    controller = TrackingController(turret) if opts.control == "continuous" else None
+
+    # with --preview, the annotated images can be watched in a browser, e.g. over an SSH tunnel
+    preview = PreviewServer(opts.preview_port, max_fps=opts.preview_fps) if opts.preview_port else None
+
     manual = False
 
     char = None
@@ -100,6 +164,9 @@ if __name__ == '__main__':
             char = getch()
 
     def leave():
+        metrics.stop_reporting()
+        if preview:
+            preview.dispose()
         turret.dispose()
         camera.dispose()
         e.set()
@@ -112,22 +179,30 @@ if __name__ == '__main__':
 
     camera_on_move = True
 
-    while not camera.new_frame_available:
-        # wait for first frame to be captured
-        time.sleep(.001)
+    # wait for first frame to be captured
+    camera.wait_for_frame()
+    metrics.record_since('startup.total', startup_time)
+    metrics.print_startup_report()
+
+    metrics.start_reporting(opts.metrics_interval, opts.metrics_file, opts.metrics_port, opts.verbose)
 
     if not opts.reset_only:
         while True:
             if char and not manual:
                 manual = True
+                turret.motion.cancel()
                 turret.launcher.ledOff()
                 print "Manual mode"
             try:
                 if manual:
+                    if controller:
+                        controller.reset()
                     face_detected, x_adj, y_adj, face_y_size = camera.face_detect()
 
                     if not opts.no_display:
                         camera.display()
+                    if preview and preview.wants_frame():
+                        preview.publish(camera.overlay_renderer())
 
                     if char:
                         key = char
@@ -138,23 +213,24 @@ if __name__ == '__main__':
                         if key == 32:
                             if camera_on_move:
                                 camera_on_move = False
-                                turret.launcher.turretStop()
+                                turret.motion.cancel()
                             else:
                                 turret.launcher.turretFire()
                                 time.sleep(3.5)
                                 turret.launcher.turretStop()
+                        # moves go through the turret's executor, which keeps track of its position
                         if key == 67:
                             camera_on_move = True
-                            turret.launcher.turretRight()
+                            turret.motion.drive(turret.launcher.RIGHT)
                         if key == 68:
                             camera_on_move = True
-                            turret.launcher.turretLeft()
+                            turret.motion.drive(turret.launcher.LEFT)
                         if key == 66:
                             camera_on_move = True
-                            turret.launcher.turretDown()
+                            turret.motion.drive(turret.launcher.DOWN)
                         if key == 65:
                             camera_on_move = True
-                            turret.launcher.turretUp()
+                            turret.motion.drive(turret.launcher.UP)
 
                         if key == 97 or key == 102 or key == 103 or key == 115:
                             camera_on_move = True
@@ -174,41 +250,64 @@ if __name__ == '__main__':
 
                         char = None
                 else:
-                    start_time = time.time()
+                    start_time = clock()
                     face_detected, x_adj, y_adj, face_y_size = camera.face_detect()
-                    detection_time = time.time()
+                    detection_time = clock()
 
                     if not opts.no_display:
                         camera.display()
+                    if preview and preview.wants_frame():
+                        preview.publish(camera.overlay_renderer())
 
                     trackingDuration = turret.updateTrackingDuration(face_detected)
 
+                    # a face breaks off any patrol (--mode=scan), so that it can be tracked
+                    if face_detected:
+                        turret.stop_scan()
+
+                    # moves run in the background, so only aim using frames taken once the turret
+                    # has stopped and settled; frames taken while moving are used for detection only.
+                    # While a missile is being fired, the turret is left alone altogether
+                    firing = turret.is_firing()
+                    settled = turret.motion.is_settled(camera.frame_time) and not firing
+
+                    if controller and not firing:
+                        controller.update(face_detected, x_adj, y_adj, camera.frame_time)
+
                     # if target is already centered in sights take the shot
-                    turret.ready_aim_fire(x_adj, y_adj, face_y_size, face_detected, camera)
+                    fired = turret.ready_aim_fire(x_adj, y_adj, face_y_size, face_detected and settled, camera)
+                    if fired and controller:
+                        # firing took over the turret, so start tracking afresh
+                        controller.reset()
 
                     if face_detected:
                         # face detected: move turret to track
-                        if opts.verbose:
-                            print "adjusting turret: x=" + str(x_adj) + ", y=" + str(y_adj)
-                        turret.adjust(x_adj, y_adj)
+                        if settled and not controller:
+                            if opts.verbose:
+                                print "adjusting turret: x=" + str(x_adj) + ", y=" + str(y_adj)
+                            turret.adjust(x_adj, y_adj)
                         turretCentered = False
-                    elif (opts.mode == "guard") and (trackingDuration < -10) and (not turretCentered):
+                    elif (opts.mode == "guard") and (trackingDuration < -10) and (not turretCentered) and not firing:
                         # If turret is in guard mode and has lost track of its target
                         # it should reset to the position it is guarding
                         turret.center()
                         turretCentered = True
-                    elif (opts.mode == "sweep") and (trackingDuration < -3):
+                    elif (opts.mode == "sweep") and (trackingDuration < -3) and settled:
                         turret.sweep()
+                    elif (opts.mode == "scan") and (trackingDuration < -3) and not turret.motion.is_moving() and not firing:
+                        # patrol continuously, looking for faces all the while
+                        turret.scan()
 
-                    movement_time = time.time()
-                    # force camera to obtain next image after movement has completed
-                    camera.new_frame_available = False
-
-                    if opts.verbose:
-                        print "total time: " + str(movement_time - start_time)
-                        print "detection time: " + str(detection_time - start_time)
-                        print "movement time: " + str(movement_time - detection_time)
+                    camera.frame_done()
+                    movement_time = clock()
+                    metrics.record('loop.total', movement_time - start_time)
+                    metrics.record('loop.detect', detection_time - start_time)
+                    metrics.record('loop.after_detect', movement_time - detection_time)
 
             except KeyboardInterrupt:
                 leave()
                 break
+            except EOFError:
+                # replaying a recording (-c FILE) and it has ended
+                leave()
+                break
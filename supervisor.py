@@ -0,0 +1,346 @@
+#!/usr/bin/python
+
+# SENTINEL SUPERVISOR
+# Drives several camera+launcher pairs from one host. Each camera is read by a capture process of its
+# own, which converts frames to grayscale straight into shared memory; a pool of detector processes
+# (one per core by default) runs face detection on the frames of all cameras, and each launcher is
+# steered by a thread of this process from the results for its camera.
+#
+# Usage: supervisor.py [options] CAMERA[@LAUNCHER] [CAMERA[@LAUNCHER] ...]
+#
+# CAMERA is a camera number, video file or image directory, as for sentinel.py -c. LAUNCHER is a
+# launcher ID as for sentinel.py -l (the default), optionally followed by #N to use the N-th attached
+# launcher of that model, counting from 0: "0@2123 1@2123#1" drives two Thunders from two cameras.
+#
+# Of the options of sentinel.py, the launcher, calibration, size, mode, origin, control, disarm,
+# profile, detect-scale, min-neighbors and metrics options apply to every stream. Frames are only kept
+# in grayscale at detection size, so there is no display, killcam or training photos. Besides those:
+#   --workers=NUM         number of detector processes. Default: number of cores
+#   --queue=NUM           frames of each camera that may wait for or be in detection
+#                         at once; newer frames are dropped while they are. Default: 2
+#
+# Per-stream frame rates, dropped frames and queue depths are reported as metrics
+# (see --metrics-file, --metrics-port and --verbose).
+
+import multiprocessing
+import numpy
+import os
+import Queue
+import signal
+import sys
+import threading
+import time
+import cv2
+from multiprocessing.sharedctypes import RawArray
+from camera import run_cascade
+from cascades import CascadeLoader
+from controller import TrackingController
+from framesource import open_source
+from metrics import metrics, clock
+from nms import merge_passes
+from options import AttributeDict, build_parser, parse_options
+from tracker import Tracker
+from turret import Turret
+
+# indices into each stream's shared capture counters
+GRABBED, DROPPED, CAPTURE_FPS = range(3)
+
+# a grayscale image of the given (height, width) shape, backed by a shared memory slot
+def slot_image(slot, shape):
+    return numpy.ctypeslib.as_array(slot).reshape(shape)
+
+# the frontal classifier, and the profile one if profile is set
+def load_classifiers(opts):
+    loaders = [CascadeLoader(opts.haar_file, 'frontal'),
+               CascadeLoader(opts.haar_profile_file, 'profile') if opts.profile else None]
+    return [loader.get() if loader else None for loader in loaders]
+
+# Reads one camera, and queues its frames for detection as grayscale images in shared memory slots.
+# A slot is handed back on the stream's free queue once a detector is done with it; if none is free
+# (detection is behind), a live camera's frame is dropped, while a recording waits.
+def capture(stream, source, size, shape, slots, free_slots, tasks, counters, stop):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the supervisor shuts us down
+    images = [slot_image(slot, shape) for slot in slots]
+    webcam, live = open_source(source)
+    if webcam.isOpened():
+        img_w, img_h = map(int, size.split('x'))
+        webcam.set(cv2.cv.CV_CAP_PROP_FRAME_WIDTH, img_w)
+        webcam.set(cv2.cv.CV_CAP_PROP_FRAME_HEIGHT, img_h)
+    else:
+        print 'Error connecting to camera ' + source
+
+    detect_h, detect_w = shape
+    frame = None
+    seq = 0
+    last_capture_time = None
+    while webcam.isOpened() and not stop.is_set():
+        if not webcam.grab():
+            if live:
+                print 'Frame grab failed on camera ' + source
+            break
+        capture_time = time.time()
+        counters[GRABBED] += 1
+        if last_capture_time is not None and capture_time > last_capture_time:
+            counters[CAPTURE_FPS] = 0.9 * counters[CAPTURE_FPS] + 0.1 / (capture_time - last_capture_time)
+        last_capture_time = capture_time
+
+        try:
+            slot = free_slots.get(block=not live)
+        except Queue.Empty:
+            counters[DROPPED] += 1
+            continue
+        retval, frame = webcam.retrieve(frame, 0)
+        if not retval:
+            free_slots.put(slot)
+            continue
+
+        # grayscale, then straight into the slot at detection size
+        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        cv2.resize(gray, (detect_w, detect_h), images[slot], interpolation=cv2.INTER_AREA)
+        seq += 1
+        tasks.put((stream, slot, seq, capture_time))
+
+    # once every slot is back, all frames have been detected on and the stream can be ended
+    for slot in slots:
+        free_slots.get()
+    tasks.put((stream, None, seq, None))
+
+# Runs face detection for any stream. On platforms that fork, the classifiers were loaded by the
+# supervisor before the detectors were started, and all detectors share their memory with it;
+# elsewhere (classifiers is None) each detector loads its own.
+def detect(opts, classifiers, shape, slots, free_slots, tasks, results):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    frontal, profile = classifiers or load_classifiers(opts)
+    images = [[slot_image(slot, shape) for slot in stream_slots] for stream_slots in slots]
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        stream, slot, seq, capture_time = task
+        if slot is None:
+            results.put((stream, seq, None, None, 0))  # end of the stream
+            continue
+
+        img = images[stream][slot]
+        start = clock()
+        try:
+            faces = run_cascade(frontal, img, minNeighbors=opts.min_neighbors)
+            if profile:
+                faces = merge_passes([faces, run_cascade(profile, img, minNeighbors=opts.min_neighbors),
+                                      run_cascade(profile, img, mirrored=True, minNeighbors=opts.min_neighbors)])
+            faces = faces[0].tolist()
+        except Exception, e:
+            faces = e  # re-raised by the supervisor
+        seconds = clock() - start
+        # the result goes out before the slot is handed back: once every slot is back, the capture
+        # process may end the stream, and the end must not overtake this frame's result
+        results.put((stream, seq, capture_time, faces, seconds))
+        free_slots[stream].put(slot)
+
+# One camera+launcher pair: follows faces in the detection results for the camera and steers its
+# turret the way sentinel.py does, on a thread of its own so that one turret firing (which takes a
+# few seconds) doesn't hold up the others
+class Stream():
+    def __init__(self, index, source, opts, shape, free_slots, counters):
+        self.index = index
+        self.source = source
+        self.opts = opts
+        self.shape = shape  # (height, width) of the detection images
+        self.free_slots = free_slots
+        self.counters = counters
+
+        self.turret = Turret(opts)
+        self.controller = TrackingController(self.turret) if opts.control == "continuous" else None
+        self.tracker = Tracker()
+        self.turret_centered = True
+
+        self.results = Queue.Queue()
+        self.last_seq = 0
+        self.frames_detected = 0
+        self.frames_stale = 0  # results that arrived after those of a later frame
+        self.detect_fps = 0.0
+        self.last_result_time = None
+
+        name = 'stream%d.' % index
+        metrics.gauge(name + 'capture_fps', lambda: round(self.counters[CAPTURE_FPS], 1))
+        metrics.gauge(name + 'detect_fps', lambda: round(self.detect_fps, 1))
+        metrics.gauge(name + 'frames_grabbed', lambda: int(self.counters[GRABBED]))
+        metrics.gauge(name + 'frames_dropped', lambda: int(self.counters[DROPPED]) + self.frames_stale)
+        metrics.gauge(name + 'frames_detected', lambda: self.frames_detected)
+        metrics.gauge(name + 'in_detection', self.in_detection)
+        metrics.gauge(name + 'backlog', lambda: self.results.qsize())
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # frames queued for or in detection
+    def in_detection(self):
+        try:
+            return self.opts.queue - self.free_slots.qsize()
+        except NotImplementedError:
+            return None  # qsize() is not available on Mac OS X
+
+    def dispose(self):
+        self.results.put(None)
+        self.thread.join()
+        if self.controller:
+            self.controller.reset()
+        self.turret.dispose()
+
+    def run(self):
+        while True:
+            result = self.results.get()
+            if result is None:
+                return
+            seq, capture_time, faces = result
+            if seq <= self.last_seq:
+                self.frames_stale += 1
+                continue
+            self.last_seq = seq
+
+            now = time.time()
+            self.frames_detected += 1
+            if self.last_result_time is not None and now > self.last_result_time:
+                self.detect_fps = 0.9 * self.detect_fps + 0.1 / (now - self.last_result_time)
+            self.last_result_time = now
+            self.steer(faces, capture_time)
+
+    def steer(self, faces, capture_time):
+        self.tracker.update(faces, capture_time)
+        target = self.tracker.target()
+
+        img_h, img_w = self.shape
+        face_detected = target is not None
+        x_adj = y_adj = face_y_size = 0
+        if face_detected:
+            x, y, w, h = target.box
+            x_adj = ((x + w/2) - img_w/2) / float(img_w)
+            y_adj = ((y + h/2) - img_h/2) / float(img_h)
+            face_y_size = h / float(img_h)
+
+        trackingDuration = self.turret.updateTrackingDuration(face_detected)
+        if face_detected:
+            self.turret.stop_scan()
+        firing = self.turret.is_firing()
+        settled = self.turret.motion.is_settled(capture_time) and not firing
+        if self.controller and not firing:
+            self.controller.update(face_detected, x_adj, y_adj, capture_time)
+
+        fired = self.turret.ready_aim_fire(x_adj, y_adj, face_y_size, face_detected and settled)
+        if fired and self.controller:
+            self.controller.reset()
+
+        if face_detected:
+            if settled and not self.controller:
+                self.turret.adjust(x_adj, y_adj)
+            self.turret_centered = False
+        elif (self.opts.mode == "guard") and (trackingDuration < -10) and (not self.turret_centered) and not firing:
+            self.turret.center()
+            self.turret_centered = True
+        elif (self.opts.mode == "sweep") and (trackingDuration < -3) and settled:
+            self.turret.sweep()
+        elif (self.opts.mode == "scan") and (trackingDuration < -3) and not self.turret.motion.is_moving() and not firing:
+            self.turret.scan()
+
+# parses CAMERA[@LAUNCHER[#N]] into the camera, launcher ID and launcher index
+def parse_stream(spec, default_launcher):
+    source, _, launcher = spec.partition('@')
+    launcher, _, index = (launcher or default_launcher).partition('#')
+    if index and not index.isdigit():
+        raise ValueError('Bad launcher number in ' + spec)
+    return source, launcher, int(index or 0)
+
+if __name__ == '__main__':
+    parser = build_parser(usage="%prog [options] CAMERA[@LAUNCHER] [CAMERA[@LAUNCHER] ...]")
+    parser.add_option("--workers", dest="workers", default=multiprocessing.cpu_count(), type="int",
+                      help="number of detector processes. Default: number of cores",
+                      metavar="NUM")
+    parser.add_option("--queue", dest="queue", default=2, type="int",
+                      help="frames of each camera that may wait for or be in detection at once; "
+                           "newer frames are dropped while they are. Default: 2",
+                      metavar="NUM")
+    opts, specs = parse_options(parser)
+    if not specs:
+        parser.error("no camera given")
+    if opts.workers < 1 or opts.queue < 1:
+        parser.error("--workers and --queue must be at least 1")
+    try:
+        specs = [parse_stream(spec, opts.launcherID) for spec in specs]
+    except ValueError, e:
+        parser.error(str(e))
+
+    if (sys.platform == 'linux2' or sys.platform == 'darwin') and not os.geteuid() == 0 and \
+            any(launcher != 'sim' for source, launcher, index in specs):
+        sys.exit("Script must be run as root.")
+
+    # loaded once, here, for all detectors (classifiers can't be handed to processes that don't fork)
+    classifiers = load_classifiers(opts) if sys.platform != 'win32' else None
+
+    # opts.queue shared memory frame slots per stream, each a grayscale image at detection size
+    img_w, img_h = map(int, opts.image_dimensions.split('x'))
+    shape = (int(round(img_h * opts.detect_scale)), int(round(img_w * opts.detect_scale)))
+    slots, free_slots, counters = [], [], []
+    for stream in range(len(specs)):
+        slots.append([RawArray('B', shape[0] * shape[1]) for slot in range(opts.queue)])
+        free_slots.append(multiprocessing.Queue())
+        for slot in range(opts.queue):
+            free_slots[stream].put(slot)
+        counters.append(RawArray('d', 3))
+
+    tasks = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    detectors = [multiprocessing.Process(target=detect,
+                                         args=(opts, classifiers, shape, slots, free_slots, tasks, results))
+                 for worker in range(opts.workers)]
+    captures = [multiprocessing.Process(target=capture,
+                                        args=(stream, source, opts.image_dimensions, shape, slots[stream],
+                                              free_slots[stream], tasks, counters[stream], stop))
+                for stream, (source, launcher, index) in enumerate(specs)]
+    for process in detectors + captures:
+        process.daemon = True
+        process.start()
+
+    # the launchers are set up once the other processes have been started, so that those don't
+    # inherit their USB handles and threads
+    streams = []
+    for stream, (source, launcher, index) in enumerate(specs):
+        stream_opts = AttributeDict(opts)
+        stream_opts.launcherID = launcher
+        stream_opts.launcher_index = index
+        stream_opts.metrics_prefix = 'stream%d.' % stream
+        streams.append(Stream(stream, source, stream_opts, shape, free_slots[stream], counters[stream]))
+
+    def queue_depth():
+        try:
+            return tasks.qsize()
+        except NotImplementedError:
+            return None
+    metrics.gauge('detect.queue_depth', queue_depth)
+    metrics.start_reporting(opts.metrics_interval, opts.metrics_file, opts.metrics_port, opts.verbose)
+
+    # hand each result to its stream, until every camera has run out of frames (or ^C)
+    running = len(streams)
+    try:
+        while running:
+            stream, seq, capture_time, faces, seconds = results.get()
+            if capture_time is None:
+                print 'Camera ' + streams[stream].source + ' has stopped'
+                running -= 1
+                continue
+            if isinstance(faces, Exception):
+                raise faces
+            metrics.record('detect.pool', seconds)
+            metrics.record('stream%d.latency' % stream, time.time() - capture_time)
+            streams[stream].results.put((seq, capture_time, faces))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        metrics.stop_reporting()
+        stop.set()
+        for stream in streams:
+            stream.dispose()
+        for process in captures + detectors:
+            process.terminate()
+        print "bye"
@@ -0,0 +1,39 @@
+import unittest
+import numpy
+from nms import non_max_suppression, merge_passes
+
+class NonMaxSuppressionTest(unittest.TestCase):
+    def test_keeps_best_of_overlapping_boxes(self):
+        boxes = numpy.array([[0, 0, 10, 10], [1, 1, 10, 10], [50, 50, 10, 10]], dtype=numpy.int32)
+        keep = non_max_suppression(boxes, [1, 2, 3])
+        self.assertEqual(keep.tolist(), [2, 1])
+
+    def test_no_boxes(self):
+        self.assertEqual(len(non_max_suppression(numpy.zeros((0, 4), dtype=numpy.int32), [])), 0)
+
+class MergePassesTest(unittest.TestCase):
+    def test_passes_of_different_lengths(self):
+        frontal = (numpy.array([[0, 0, 10, 10], [100, 0, 10, 10], [200, 0, 10, 10]], dtype=numpy.int32),
+                   numpy.array([5.0, 1.0, 2.0]))
+        profile = (numpy.array([[1, 1, 10, 10]], dtype=numpy.int32), numpy.array([3.0]))
+        faces, sources = merge_passes([frontal, profile])
+        # the profile face overlaps the best frontal face and is dropped; the other two frontal faces stay
+        self.assertEqual(faces.tolist(), [[0, 0, 10, 10], [200, 0, 10, 10], [100, 0, 10, 10]])
+        self.assertEqual(sources.tolist(), [0, 0, 0])
+
+    def test_most_confident_pass_wins(self):
+        frontal = (numpy.array([[0, 0, 10, 10]], dtype=numpy.int32), numpy.array([1.0]))
+        profile = (numpy.array([[1, 1, 10, 10], [50, 50, 10, 10]], dtype=numpy.int32), numpy.array([3.0, 2.0]))
+        faces, sources = merge_passes([frontal, profile])
+        self.assertEqual(faces.tolist(), [[1, 1, 10, 10], [50, 50, 10, 10]])
+        self.assertEqual(sources.tolist(), [1, 1])
+
+    def test_empty_pass(self):
+        frontal = (numpy.zeros((0, 4), dtype=numpy.int32), numpy.zeros(0))
+        profile = (numpy.array([[5, 5, 10, 10]], dtype=numpy.int32), numpy.array([1.0]))
+        faces, sources = merge_passes([frontal, profile])
+        self.assertEqual(faces.tolist(), [[5, 5, 10, 10]])
+        self.assertEqual(sources.tolist(), [1])
+
+if __name__ == '__main__':
+    unittest.main()
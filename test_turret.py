@@ -0,0 +1,80 @@
+import unittest
+import turret
+from metrics import Metrics
+
+# stands in for the time module, so that moves take no real time
+class FakeClock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+class FakeLauncher():
+    LEFT, RIGHT, UP, DOWN = 4, 8, 1, 2
+    x_range = 6.5
+    y_range = .75
+
+class PoseEstimateTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.real_time, turret.time = turret.time, self.clock
+        self.launcher = FakeLauncher()
+        self.pose = turret.PoseEstimate(self.launcher, stats=Metrics())
+
+    def tearDown(self):
+        turret.time = self.real_time
+
+    def drive(self, direction, seconds, reads=1):
+        self.pose.set_direction(direction)
+        for i in range(reads):
+            self.clock.now += float(seconds) / reads
+            self.pose.position()  # as the metrics reporter does while the turret moves
+        self.pose.set_direction(0)
+
+    def test_full_range_in_one_reading_homes(self):
+        self.drive(self.launcher.LEFT, self.launcher.x_range)
+        self.assertEqual(self.pose.x_bounds, (0.0, 0.0))
+
+    def test_full_range_read_partway_homes(self):
+        self.drive(self.launcher.RIGHT, 1.5)  # somewhere in the middle, with some slack
+        self.drive(self.launcher.LEFT, self.launcher.x_range, reads=4)
+        self.assertEqual(self.pose.x_bounds, (0.0, 0.0))
+        self.assertEqual(self.pose.position()[0], 0.0)
+
+    def test_move_back_out_widens_by_drift(self):
+        self.drive(self.launcher.LEFT, self.launcher.x_range)
+        self.drive(self.launcher.RIGHT, self.launcher.x_range * .5, reads=3)
+        low, high = self.pose.x_bounds
+        self.assertAlmostEqual(low, .475)
+        self.assertAlmostEqual(high, .525)
+
+    def test_axes_are_kept_apart(self):
+        self.drive(self.launcher.UP, self.launcher.y_range, reads=3)
+        self.assertEqual(self.pose.y_bounds, (0.0, 0.0))
+        self.assertEqual(self.pose.x_bounds, (0.0, 1.0))
+
+class StubLauncher(turret.Launcher):
+    LEFT, RIGHT, UP, DOWN = 4, 8, 1, 2
+    def __init__(self):
+        self.x_speed, self.y_speed = 1.2, .48
+        self.x_range, self.y_range = 6.5, .75
+
+class CalibrateTest(unittest.TestCase):
+    def test_takes_over_measured_constants(self):
+        launcher = StubLauncher()
+        launcher.calibrate({'speeds': {'left': 1.0, 'right': 1.4}, 'x_range': 6.0, 'y_range': .9})
+        self.assertEqual(launcher.speed(launcher.LEFT), 1.0)
+        self.assertAlmostEqual(launcher.x_speed, 1.2)
+        self.assertEqual((launcher.x_range, launcher.y_range), (6.0, .9))
+
+    def test_ignores_failed_measurements(self):
+        launcher = StubLauncher()
+        launcher.calibrate({'speeds': {'up': 0.0, 'down': None, 'left': -1.2, 'right': 1e6},
+                            'x_range': 0.0, 'y_range': .01})
+        self.assertEqual(launcher.speeds, {})
+        self.assertEqual((launcher.x_speed, launcher.y_speed), (1.2, .48))
+        self.assertEqual((launcher.x_range, launcher.y_range), (6.5, .75))
+
+if __name__ == '__main__':
+    unittest.main()
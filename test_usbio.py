@@ -0,0 +1,111 @@
+import threading
+import unittest
+from metrics import Metrics
+from usbio import UsbCommandWriter, transfer
+
+# a command whose single transfer carries the given byte, which FakeDevice records
+def command(byte):
+    return (transfer(0x21, 0x09, 0, 0, [byte]),)
+
+RIGHT, LEFT, STOP, FIRE, LED_ON, LED_OFF = 1, 2, 3, 4, 5, 6
+
+# records what is written to it; while held, the writer thread blocks in the next transfer so that
+# commands pile up in the queue behind it
+class FakeDevice():
+    def __init__(self, error=None):
+        self.written = []
+        self.error = error
+        self.released = threading.Event()
+        self.released.set()
+        self.writing = threading.Event()
+
+    def hold(self):
+        self.released.clear()
+        self.writing.clear()
+
+    def release(self):
+        self.released.set()
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue, wIndex, payload, timeout):
+        self.writing.set()
+        self.released.wait()
+        if self.error:
+            raise self.error
+        self.written.append(payload[0])
+
+class UsbCommandWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.dev = FakeDevice()
+        self.writer = UsbCommandWriter(self.dev, stats=Metrics())
+
+    def tearDown(self):
+        self.dev.release()
+        self.writer.dispose()
+
+    # queues commands behind one that the writer thread is stuck writing
+    def hold(self):
+        self.dev.hold()
+        self.writer.send('fire', command(FIRE))
+        self.dev.writing.wait()
+
+    def test_state_in_effect_is_skipped(self):
+        self.writer.set_state('stop', 'stop', command(STOP))
+        self.writer.flush()
+        self.writer.set_state('stop', 'stop', command(STOP))
+        self.writer.set_state('led', False, command(LED_OFF), channel='led')
+        self.writer.flush()
+        self.writer.set_state('led', False, command(LED_OFF), channel='led')
+        self.writer.flush()
+        self.assertEqual(self.dev.written, [STOP, LED_OFF])
+        self.assertEqual(self.writer.writes_skipped, 2)
+
+    def test_pending_state_is_replaced(self):
+        self.hold()
+        self.writer.set_state('right', 'right', command(RIGHT))
+        self.writer.set_state('led', True, command(LED_ON), channel='led')
+        self.writer.set_state('left', 'left', command(LEFT))
+        self.writer.set_state('led', False, command(LED_OFF), channel='led')
+        self.dev.release()
+        self.writer.flush()
+        self.assertEqual(self.dev.written, [FIRE, LEFT, LED_OFF])
+        self.assertEqual(self.writer.states_coalesced, 2)
+
+    def test_state_is_not_replaced_across_a_queued_fire(self):
+        self.hold()
+        self.writer.set_state('right', 'right', command(RIGHT))
+        self.writer.send('fire', command(FIRE), resets_state=True)
+        self.writer.set_state('left', 'left', command(LEFT))
+        self.dev.release()
+        self.writer.flush()
+        self.assertEqual(self.dev.written, [FIRE, RIGHT, FIRE, LEFT])
+
+    def test_fire_resets_the_motion_state_only(self):
+        self.writer.set_state('stop', 'stop', command(STOP))
+        self.writer.set_state('led', True, command(LED_ON), channel='led')
+        self.writer.flush()
+        self.hold()
+        self.writer.send('fire', command(FIRE), resets_state=True)
+        self.writer.set_state('stop', 'stop', command(STOP))  # while the fire is still queued
+        self.writer.set_state('led', True, command(LED_ON), channel='led')
+        self.dev.release()
+        self.writer.flush()
+        self.assertEqual(self.dev.written, [STOP, LED_ON, FIRE, FIRE, STOP])
+
+    def test_transfer_error_does_not_hang_flush(self):
+        self.dev.error = ValueError('device gone')
+        self.writer.set_state('stop', 'stop', command(STOP))
+        flushing = threading.Thread(target=self.writer.flush)
+        flushing.daemon = True
+        flushing.start()
+        flushing.join(5)
+        self.assertFalse(flushing.is_alive())
+        self.assertEqual(self.writer.errors, 1)
+
+        # the device may not be in the state, so it is written again
+        self.dev.error = None
+        self.writer.set_state('stop', 'stop', command(STOP))
+        self.writer.flush()
+        self.assertEqual(self.dev.written, [STOP])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import itertools
+import numpy
+
+# the Hungarian algorithm is only worth it for crowds, and scipy is only an optional dependency
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+# intersection over union of two [x, y, w, h] boxes
+def iou(a, b):
+    w = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    h = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    intersection = float(w * h)
+    return intersection / (a[2] * a[3] + b[2] * b[3] - intersection)
+
+# A face followed across frames: its last box, velocity (pixels per second), and how many
+# detection passes it has been seen in (hits) and missed in a row (misses)
+class Track():
+    def __init__(self, track_id, box, timestamp, cascade=None):
+        self.id = track_id
+        self.box = list(box)
+        self.cascade = cascade  # name of the cascade that last found it, if known
+        self.timestamp = timestamp  # capture time of the frame the box was last measured in
+        self.vx = self.vy = 0.0
+        self.age = 0
+        self.hits = 1
+        self.misses = 0
+
+    # box extrapolated to the given time at the track's current velocity
+    def predict(self, timestamp):
+        dt = timestamp - self.timestamp
+        x, y, w, h = self.box
+        return [int(round(x + self.vx * dt)), int(round(y + self.vy * dt)), w, h]
+
+    def update(self, box, timestamp, cascade=None):
+        dt = timestamp - self.timestamp
+        if dt > 0:
+            # smooth the velocity, since box positions jitter by a few pixels between frames
+            self.vx = 0.5 * self.vx + 0.5 * (box[0] + box[2] / 2.0 - self.box[0] - self.box[2] / 2.0) / dt
+            self.vy = 0.5 * self.vy + 0.5 * (box[1] + box[3] / 2.0 - self.box[1] - self.box[3] / 2.0) / dt
+        self.box = list(box)
+        self.timestamp = timestamp
+        self.cascade = cascade or self.cascade
+        self.hits += 1
+        self.misses = 0
+
+# Associates face detections across frames, so that each person keeps a track ID, and picks a
+# target to aim at: once chosen, the target is kept for as long as its track lives, rather than
+# switching to whichever face happens to look biggest in the current frame.
+class Tracker():
+    def __init__(self, max_misses=3, min_iou=.1, hungarian_above=4):
+        self.max_misses = max_misses  # detection passes a track may go unseen before it is dropped
+        self.min_iou = min_iou
+        self.hungarian_above = hungarian_above  # use optimal matching with more boxes than this
+        self.tracks = []
+        self.target_id = None
+        self.ids = itertools.count(1)
+
+    # matches the faces found in a frame captured at timestamp to the existing tracks; cascades
+    # optionally names the cascade that found each face
+    def update(self, faces, timestamp, cascades=None):
+        cascades = cascades or [None] * len(faces)
+        for track in self.tracks:
+            track.age += 1
+        predicted = [track.predict(timestamp) for track in self.tracks]
+
+        matches = self.match(predicted, faces)
+        matched_tracks = set(t for t, f in matches)
+        matched_faces = set(f for t, f in matches)
+        for t, f in matches:
+            self.tracks[t].update(faces[f], timestamp, cascades[f])
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+        for f, face in enumerate(faces):
+            if f not in matched_faces:
+                self.tracks.append(Track(self.ids.next(), face, timestamp, cascades[f]))
+
+        self.select_target()
+        return self.visible(timestamp)
+
+    # for frames on which detection is skipped: where the tracks seen last time are expected to be
+    def predict(self, timestamp):
+        for track in self.tracks:
+            track.age += 1
+        return self.visible(timestamp)
+
+    # (track, box) pairs for the tracks seen in the last detection pass, boxes predicted to timestamp
+    def visible(self, timestamp):
+        return [(track, track.predict(timestamp)) for track in self.tracks if track.misses == 0]
+
+    # the track to aim at, or None if it was not seen in the last detection pass
+    def target(self):
+        for track in self.tracks:
+            if track.id == self.target_id and track.misses == 0:
+                return track
+        return None
+
+    # keep the current target while its track lives, otherwise pick the biggest face in view
+    def select_target(self):
+        if any(track.id == self.target_id for track in self.tracks):
+            return
+        visible = [track for track in self.tracks if track.misses == 0]
+        if visible:
+            self.target_id = max(visible, key=lambda track: track.box[2] * track.box[3]).id
+        else:
+            self.target_id = None
+
+    # returns (track index, face index) pairs of matching boxes
+    def match(self, predicted, faces):
+        if not predicted or not faces:
+            return []
+        overlaps = [[iou(p, f) for f in faces] for p in predicted]
+
+        if linear_sum_assignment is not None and max(len(predicted), len(faces)) > self.hungarian_above:
+            rows, cols = linear_sum_assignment(-numpy.array(overlaps))
+            pairs = zip(rows.tolist(), cols.tolist())
+        else:
+            # greedy: best overlapping pairs first, which is good enough for the few faces usually in view
+            candidates = sorted(((overlaps[t][f], t, f) for t in range(len(predicted)) for f in range(len(faces))),
+                                reverse=True)
+            pairs, used_tracks, used_faces = [], set(), set()
+            for overlap, t, f in candidates:
+                if t not in used_tracks and f not in used_faces:
+                    pairs.append((t, f))
+                    used_tracks.add(t)
+                    used_faces.add(f)
+        return [(t, f) for t, f in pairs if overlaps[t][f] >= self.min_iou]
@@ -0,0 +1,119 @@
+import collections
+import json
+import os
+import time
+import cv2
+import numpy
+from imagewriter import FileSequence
+
+# 64-bit difference hash of an image: whether each pixel of a 9x8 grayscale thumbnail is brighter
+# than its right-hand neighbour. Near-identical images have hashes a few bits apart.
+def dhash(img):
+    if len(img.shape) == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    thumb = cv2.resize(img, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (thumb[:, 1:] > thumb[:, :-1]).flatten()
+    return sum(1 << i for i in numpy.flatnonzero(bits).tolist())
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+# Collects face crops for training. Faces are saved at most rate times a second, and only when they
+# differ from the last few hundred saved (by difference hash); each is a JPEG of the face alone.
+#
+# Crops are appended to pack files (faces<N>.pack), with a line of JSON per crop in a matching index
+# (faces<N>.idx) giving its offset and length in the pack, the face box in the frame, capture time,
+# cascade and track ID. A new pack is started once one reaches shard_size bytes, so that a day of
+# captures is a handful of files rather than a directory of millions. Writing happens on the
+# ImageWriter's thread.
+class TrainingStore():
+    def __init__(self, directory, writer, rate=1.0, min_distance=6, shard_size=64 << 20):
+        self.directory = directory
+        self.writer = writer
+        self.interval = 1.0 / rate      # seconds between saved faces
+        self.min_distance = min_distance  # hashes at most this many bits apart count as duplicates
+        self.shard_size = shard_size
+        self.recent = collections.deque(maxlen=256)  # hashes of the faces saved last
+        self.last_saved = 0
+        self.skipped_duplicates = 0
+
+        # carry on with the last pack, if there is room left in it
+        self.shards = FileSequence(directory, ['faces'])
+        self.shard = max(self.shards.count - 1, 0)
+        if os.path.exists(self.pack_path()) and os.path.getsize(self.pack_path()) >= self.shard_size:
+            self.shard = self.shards.count
+        self.shards.count = self.shard + 1
+        self.pack = self.index = None
+
+    def pack_path(self):
+        return self.shards.path('faces', self.shard, '.pack')
+
+    # considers the face in the [x, y, w, h] box of a frame for saving; returns whether it was queued
+    def add(self, img, box, timestamp, cascade=None, track_id=None):
+        now = time.time()
+        if now - self.last_saved < self.interval:
+            return False
+        x, y, w, h = box
+        crop = img[max(y, 0):y+h, max(x, 0):x+w]
+        if crop.size == 0:
+            return False
+
+        fingerprint = dhash(crop)
+        if any(hamming(fingerprint, seen) <= self.min_distance for seen in self.recent):
+            self.skipped_duplicates += 1
+            return False
+        if not self.writer.accepts():
+            return False
+        self.recent.append(fingerprint)
+        self.last_saved = now
+
+        info = {'time': timestamp, 'box': list(box), 'cascade': cascade, 'track': track_id,
+                'hash': '%016x' % fingerprint}
+        return self.writer.submit(self.append, (crop.copy(), info), droppable=False)
+
+    # runs on the writer thread
+    def append(self, crop, info):
+        retval, data = cv2.imencode('.jpg', crop, [cv2.cv.CV_IMWRITE_JPEG_QUALITY, self.writer.quality])
+        if not retval:
+            return False
+        data = data.tostring()
+
+        if self.pack is None or self.pack.tell() + len(data) > self.shard_size:
+            self.open_shard()
+        info['offset'] = self.pack.tell()
+        info['length'] = len(data)
+
+        # the crop goes in before its index line, so that the index never points past the end of the pack
+        self.pack.write(data)
+        self.pack.flush()
+        self.index.write(json.dumps(info, sort_keys=True) + '\n')
+        self.index.flush()
+        return True
+
+    def open_shard(self):
+        if self.pack is not None:
+            self.close()
+            self.shard = self.shards.next()
+        self.pack = open(self.pack_path(), 'ab')
+        self.pack.seek(0, os.SEEK_END)  # tell() is not at the end of a file opened for append until written to
+        self.index = open(self.shards.path('faces', self.shard, '.idx'), 'a')
+
+    # call once the writer has been disposed of
+    def close(self):
+        if self.pack is not None:
+            self.pack.close()
+            self.index.close()
+            self.pack = self.index = None
+
+# reads back the faces saved in a directory, as (info, JPEG data) pairs
+def read_faces(directory):
+    shards = FileSequence(directory, ['faces'])
+    for shard in range(shards.count):
+        index_path = shards.path('faces', shard, '.idx')
+        if not os.path.exists(index_path):
+            continue
+        with open(shards.path('faces', shard, '.pack'), 'rb') as pack:
+            for line in open(index_path):
+                info = json.loads(line)
+                pack.seek(info['offset'])
+                yield info, pack.read(info['length'])
@@ -1,46 +1,356 @@
-import os
 import time
-import cv2
 import sys
+import os
+import re
+import json
 import math
+import threading
+import collections
 import usb
+import usb.util
 import camera
+from metrics import metrics, clock
+from usbio import UsbCommandWriter, transfer
+from imagewriter import FileSequence, ImageWriter
+from training import TrainingStore
+
+# finds the index-th attached launcher with the given USB IDs (counting from 0), or returns None
+def find_device(vendor_id, product_id, index=0):
+    devices = list(usb.core.find(find_all=True, idVendor=vendor_id, idProduct=product_id) or [])
+    return devices[index] if index < len(devices) else None
+
+# a name for a USB device that stays the same when it is replugged or the machine restarts (unlike
+# the order devices are found in): its serial number or, for devices without one, the bus and port
+# it is plugged into. None if neither can be told.
+def device_id(dev):
+    try:
+        if dev.iSerialNumber:
+            serial = usb.util.get_string(dev, dev.iSerialNumber)
+            if serial:
+                return 'serial-' + re.sub(r'[^A-Za-z0-9_.-]', '_', serial)
+    except (usb.core.USBError, ValueError, TypeError, NotImplementedError):
+        pass  # no permission to read it, or a PyUSB too old to know get_string(dev, index)
+    ports = getattr(dev, 'port_numbers', None)
+    if ports:
+        return 'port-%d-%s' % (dev.bus, '.'.join(map(str, ports)))
+    return None
+
+# where the calibration profile of the launcher with the given ID and device_id() is kept (see
+# calibrate.py), or None if the device can't be told apart from others of its model
+def calibration_path(directory, launcher_id, device):
+    if device is None:
+        return None
+    return os.path.join(directory, 'launcher-%s-%s.json' % (launcher_id, device))
 
 class Launcher(): # a parent class for our low level missile launchers.
 #Contains general movement commands which may be overwritten in case of hardware specific tweaks.
-            
+
+    speeds = {}  # calibrated speeds by direction bitmask, see speed()
+    device = None  # device_id() of the launcher, which its calibration profile is kept under
+
+    # seconds of moving in the given direction that shift the camera's view by a whole image width
+    # (LEFT, RIGHT) or height (UP, DOWN); x_speed and y_speed unless calibrated per direction
+    def speed(self, direction):
+        if direction in self.speeds:
+            return self.speeds[direction]
+        return self.x_speed if direction & (self.LEFT | self.RIGHT) else self.y_speed
+
+    # the constants of a calibration profile, as saved by calibrate.py
+    def calibration(self):
+        return {'speeds': dict((name, self.speed(direction)) for name, direction in self.directionNames()),
+                'x_range': self.x_range,
+                'y_range': self.y_range}
+
+    # True if a calibrated constant is within calibration_tolerance times the current estimate of it;
+    # anything further off (or not a positive number at all) is taken to be a failed measurement
+    calibration_tolerance = 4.0
+    def plausible(self, value, estimate):
+        return (isinstance(value, (int, float)) and
+                estimate / self.calibration_tolerance <= value <= estimate * self.calibration_tolerance)
+
+    # takes over the constants of a calibration profile in place of the experimentally estimated ones
+    def calibrate(self, profile):
+        speeds = profile.get('speeds', {})
+        estimates = dict((direction, self.speed(direction)) for name, direction in self.directionNames())
+        self.speeds = {}
+        for name, direction in self.directionNames():
+            if name not in speeds:
+                continue
+            if self.plausible(speeds[name], estimates[direction]):
+                self.speeds[direction] = speeds[name]
+            else:
+                print 'Ignoring calibrated speed going %s: %r' % (name, speeds[name])
+        if self.LEFT in self.speeds and self.RIGHT in self.speeds:
+            self.x_speed = (self.speeds[self.LEFT] + self.speeds[self.RIGHT]) / 2
+        if self.UP in self.speeds and self.DOWN in self.speeds:
+            self.y_speed = (self.speeds[self.UP] + self.speeds[self.DOWN]) / 2
+        for name in ['x_range', 'y_range']:
+            if name in profile:
+                if self.plausible(profile[name], getattr(self, name)):
+                    setattr(self, name, profile[name])
+                else:
+                    print 'Ignoring calibrated %s: %r' % (name, profile[name])
+
+    def directionNames(self):
+        return [('left', self.LEFT), ('right', self.RIGHT), ('up', self.UP), ('down', self.DOWN)]
+
     # roughly centers the turret at the origin
     def center(self, x_origin=0.5, y_origin=0.5):
         print 'Centering camera ...'
         self.moveToPosition(x_origin,y_origin)
 
     def moveToPosition(self, right_percentage, down_percentage): 
-        self.turretLeft()
-        time.sleep( self.x_range)
-        self.turretRight()
-        time.sleep( right_percentage * self.x_range)
-        self.turretStop()
-
-        self.turretUp()
-        time.sleep( self.y_range)
-        self.turretDown()
-        time.sleep( down_percentage * self.y_range) 
-        self.turretStop()
+        self.runSegments(self.positionSegments(right_percentage, down_percentage))
 
     def moveRelative(self, right_percentage, down_percentage):
+        self.runSegments(self.relativeSegments(right_percentage, down_percentage))
+
+    # timed moves are described as a list of (direction bitmask, seconds) segments,
+    # so that they can either be run in place or handed to a MotionExecutor
+    def positionSegments(self, right_percentage, down_percentage):
+        # drive against the end stops first, then move back out to the requested position
+        return [(self.LEFT, self.x_range),
+                (self.RIGHT, right_percentage * self.x_range),
+                (self.UP, self.y_range),
+                (self.DOWN, down_percentage * self.y_range)]
+
+    def relativeSegments(self, right_percentage, down_percentage):
+        segments = []
         if (right_percentage>0):
-            self.turretRight()
+            segments.append((self.RIGHT, right_percentage * self.x_range))
         elif(right_percentage<0):
-            self.turretLeft()
-        time.sleep( abs(right_percentage) * self.x_range)
-        self.turretStop()
+            segments.append((self.LEFT, -right_percentage * self.x_range))
         if (down_percentage>0):
-            self.turretDown()
+            segments.append((self.DOWN, down_percentage * self.y_range))
         elif(down_percentage<0):
-            self.turretUp()
-        time.sleep( abs(down_percentage) * self.y_range)
+            segments.append((self.UP, -down_percentage * self.y_range))
+        return segments
+
+    # runs a list of timed segments on the calling thread, then stops
+    def runSegments(self, segments):
+        for direction, duration in segments:
+            if duration > 0:
+                self.turretDirection(direction)
+                time.sleep(duration)
         self.turretStop()
 
+    # waits for queued commands to reach the device (launchers that queue them override this)
+    def dispose(self):
+        pass
+
+
+# Dead-reckoning estimate of where the turret points, as fractions of its range (0, 0 being the top
+# left end stop), integrated from the directions it is driven in and for how long. Each axis is kept
+# as the interval the turret is known to be within: moving widens it by drift per full range moved
+# (the speed of the motors varies), and driving against an end stop narrows it again, so that
+# positionSegments() (which starts by driving against the stops) homes the estimate. How far each
+# axis has moved since its direction last changed is kept too, as the estimate is brought up to date
+# whenever it is read (by the metrics reporter too), not just when the direction changes.
+class PoseEstimate():
+    def __init__(self, launcher, drift=.05, stats=metrics):
+        self.launcher = launcher
+        self.drift = drift
+        self.lock = threading.Lock()
+        self.x_bounds = (0.0, 1.0)  # nothing is known until the turret is first homed
+        self.y_bounds = (0.0, 1.0)
+        self.x_direction = 0
+        self.y_direction = 0
+        self.x_travel = 0.0  # fractions of the range moved since the direction last changed
+        self.y_travel = 0.0
+        self.since = time.time()
+        stats.gauge('pose.x', lambda: self.position()[0])
+        stats.gauge('pose.y', lambda: self.position()[1])
+        stats.gauge('pose.error', self.error)
+
+    # the turret has started moving in the given direction (0 when it has stopped)
+    def set_direction(self, direction):
+        self.lock.acquire()
+        self.advance(time.time())
+        launcher = self.launcher
+        x_direction = (1 if direction & launcher.RIGHT else 0) - (1 if direction & launcher.LEFT else 0)
+        y_direction = (1 if direction & launcher.DOWN else 0) - (1 if direction & launcher.UP else 0)
+        if x_direction != self.x_direction:
+            self.x_direction, self.x_travel = x_direction, 0.0
+        if y_direction != self.y_direction:
+            self.y_direction, self.y_travel = y_direction, 0.0
+        self.lock.release()
+
+    # estimated (x, y) now
+    def position(self):
+        self.lock.acquire()
+        self.advance(time.time())
+        (x_low, x_high), (y_low, y_high) = self.x_bounds, self.y_bounds
+        self.lock.release()
+        return (x_low + x_high) / 2, (y_low + y_high) / 2
+
+    # how far off the estimate may be, on the worse axis
+    def error(self):
+        self.lock.acquire()
+        self.advance(time.time())
+        error = max(self.x_bounds[1] - self.x_bounds[0], self.y_bounds[1] - self.y_bounds[0]) / 2
+        self.lock.release()
+        return error
+
+    def advance(self, now):
+        elapsed = now - self.since
+        self.since = now
+        if elapsed > 0:
+            x_distance = self.x_direction * elapsed / self.launcher.x_range
+            y_distance = self.y_direction * elapsed / self.launcher.y_range
+            self.x_bounds, self.x_travel = self.move(self.x_bounds, self.x_travel, x_distance)
+            self.y_bounds, self.y_travel = self.move(self.y_bounds, self.y_travel, y_distance)
+
+    # the bounds and travel of an axis after moving it by distance (in fractions of its range)
+    def move(self, bounds, travel, distance):
+        if not distance:
+            return bounds, travel
+        travel += distance
+        if abs(travel) >= 1:
+            # driven for the whole range or more: wherever it was, the turret is against the end stop
+            stop = 0.0 if travel < 0 else 1.0
+            return (stop, stop), travel
+        slack = self.drift * abs(distance)
+        low = min(max(bounds[0] + distance - slack, 0.0), 1.0)
+        high = min(max(bounds[1] + distance + slack, 0.0), 1.0)
+        return (low, high), travel
+
+
+# Runs timed turret moves on a dedicated thread so that the main loop can keep detecting
+# faces while the launcher is moving. A move is a list of (direction bitmask, seconds)
+# segments (None seconds meaning until interrupted); the turret is stopped after the last
+# segment of a move, unless another move is already waiting to run.
+class MotionExecutor():
+    def __init__(self, launcher, settle_time=.2, stats=metrics):
+        self.launcher = launcher
+        # OpenCV takes pictures VERY quickly, so frames captured right after a move
+        # are blurred by camera wobble until the turret has had time to settle
+        self.settle_time = settle_time
+
+        self.moves = collections.deque()
+        self.condition = threading.Condition()
+        self.interrupted = False
+        self.busy = False
+        self.running = True
+        self.settled_at = time.time()
+
+        # every move goes through here, so this is where the turret's position is kept track of
+        self.pose = PoseEstimate(launcher, stats=stats)
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # queues a move to run after any moves already pending
+    def submit(self, segments):
+        self.condition.acquire()
+        self.moves.append(list(segments))
+        self.condition.notify_all()
+        self.condition.release()
+
+    # aborts the current move and any pending ones, then runs the given move
+    def replace(self, segments):
+        self.condition.acquire()
+        self.moves.clear()
+        self.moves.append(list(segments))
+        self.interrupted = True
+        self.condition.notify_all()
+        self.condition.release()
+
+    # keeps the turret moving in the given direction until told otherwise (0 stops it)
+    def drive(self, direction):
+        if direction:
+            self.replace([(direction, None)])
+        else:
+            self.cancel()
+
+    # aborts the current move and any pending ones, leaving the turret stopped
+    def cancel(self):
+        self.condition.acquire()
+        self.moves.clear()
+        self.interrupted = self.busy
+        self.condition.notify_all()
+        self.condition.release()
+
+    def is_moving(self):
+        return self.busy or len(self.moves) > 0
+
+    # True if the turret has stopped and settled, optionally no later than the given time
+    # (e.g. the time a frame was captured, to know whether it can be trusted for aiming)
+    def is_settled(self, at_time=None):
+        if at_time is None:
+            at_time = time.time()
+        return not self.is_moving() and self.settled_at <= at_time
+
+    # blocks until all moves have completed and the turret has settled
+    def wait(self):
+        self.condition.acquire()
+        while self.running and self.is_moving():
+            self.condition.wait()
+        self.condition.release()
+        remaining = self.settled_at - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def dispose(self):
+        self.condition.acquire()
+        self.moves.clear()
+        self.running = False
+        self.interrupted = True
+        self.condition.notify_all()
+        self.condition.release()
+        self.thread.join()
+
+    def run(self):
+        while True:
+            self.condition.acquire()
+            while self.running and not self.moves:
+                self.condition.wait()
+            if not self.running:
+                self.condition.release()
+                return
+            segments = self.moves.popleft()
+            self.busy = True
+            self.interrupted = False
+            self.condition.release()
+
+            for direction, duration in segments:
+                if duration is not None and duration <= 0:
+                    continue
+                self.launcher.turretDirection(direction)
+                self.pose.set_direction(direction)
+
+                # sleep until the segment is over, waking early if the move is interrupted
+                self.condition.acquire()
+                if duration is None:
+                    while not self.interrupted:
+                        self.condition.wait()
+                else:
+                    deadline = time.time() + duration
+                    while not self.interrupted:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            break
+                        self.condition.wait(remaining)
+                interrupted = self.interrupted
+                self.condition.release()
+                if interrupted:
+                    break
+
+            # go straight into the next move if there is one, rather than stopping in between
+            self.condition.acquire()
+            stopping = not self.moves or not self.running
+            self.condition.release()
+            if stopping:
+                self.launcher.turretStop()
+                self.pose.set_direction(0)
+
+            self.condition.acquire()
+            self.busy = False
+            if stopping:
+                self.settled_at = time.time() + self.settle_time
+            self.condition.notify_all()
+            self.condition.release()
+
 # Launcher commands for USB Missile Launcher (VendorID:0x1130 ProductID:0x0202 Tenx Technology, Inc.)
 class Launcher1130(Launcher):
     # Commands and control messages are derived from
@@ -58,11 +368,12 @@ class Launcher1130(Launcher):
     # Low level launcher driver commands
     # this code mostly taken from https://github.com/nmilford/stormLauncher
     # with bits from https://github.com/codedance/Retaliation
-    def __init__(self):
+    def __init__(self, coalesce_window=0.0, timeout=250, device_index=0, stats=metrics):
         # HID detach for Linux systems...not tested with 0x1130 product
-        self.dev = usb.core.find(idVendor=0x1130, idProduct=0x0202)
+        self.dev = find_device(0x1130, 0x0202, device_index)
         if self.dev is None:
                 raise ValueError('Missile launcher not found.')
+        self.device = device_id(self.dev)
         if sys.platform == "linux2":
             try:
                 if self.dev.is_kernel_driver_active(1) is True:
@@ -74,6 +385,10 @@ class Launcher1130(Launcher):
 
         self.dev.set_configuration()
 
+        # commands are written by a dedicated thread, which also keeps each command's three
+        # transfers from interleaving with another's
+        self.writer = UsbCommandWriter(self.dev, coalesce_window, timeout, stats)
+
         self.missile_capacity = 3
 #experimentally estimated speed scaling factors 
         self.y_speed = 0.48
@@ -89,50 +404,58 @@ class Launcher1130(Launcher):
         self.DOWN   =   8
         
         self.BLANK_data   =   [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x08, 0x08]
-        self.LEFT_data   =   [0x00, 0x01, 0x00, 0x00, 0x00, 0x00, 0x08, 0x08]
-        self.RIGHT_data  =   [0x00, 0x00, 0x01, 0x00, 0x00, 0x00, 0x08, 0x08]
-        self.UP_data     =   [0x00, 0x00, 0x00, 0x01, 0x00, 0x00, 0x08, 0x08]
-        self.DOWN_data   =   [0x00, 0x00, 0x00, 0x00, 0x01, 0x00, 0x08, 0x08]
         self.FIRE   =   [0x00, 0x00, 0x00, 0x00, 0x00, 0x01, 0x08, 0x08]
-        self.STOP   =   [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x08, 0x08]
+
+        # Missile launcher requires two init-packets before the actual command can be sent.
+        # The init-packets consist of 8 Bit payload, the actual command is 64 Bit payload
+        self.init_transfers = (transfer(0x21, 0x09, 0x2, 0x01, [ord('U'), ord('S'), ord('B'), ord('C'), 0, 0, 4, 0]),
+                               transfer(0x21, 0x09, 0x2, 0x01, [ord('U'), ord('S'), ord('B'), ord('C'), 0, 64, 2, 0]))
+
+        # every command is built once, up front. Directions are keyed by the motors they turn on
+        # (left wins over right and up over down), so that equivalent bitmasks share a state
+        self.direction_keys = {}
+        self.direction_commands = {}
+        for direction in range(16):
+            cmd = self.BLANK_data + self.cmdFill
+            if (direction & self.LEFT == self.LEFT ):
+                    cmd[1] = 0x1
+            elif (direction & self.RIGHT == self.RIGHT ):
+                    cmd[2] = 0x1
+
+            if (direction & self.UP == self.UP ):
+                    cmd[3] = 0x1
+            elif (direction & self.DOWN == self.DOWN ):
+                    cmd[4] = 0x1
+            self.direction_keys[direction] = tuple(cmd[1:5])
+            self.direction_commands[direction] = self.command(cmd)
+        self.fire_command = self.command(self.FIRE + self.cmdFill)
+
+    def command(self, cmd):
+        return self.init_transfers + (transfer(0x21, 0x09, 0x2, 0x00, cmd),)
+
+    def setDirection(self, name, direction):
+        self.writer.set_state(name, self.direction_keys[direction], self.direction_commands[direction])
 
     def turretLeft(self):
-        cmd = self.LEFT_data + self.cmdFill
-        self.turretMove(cmd)
+        self.setDirection('left', self.LEFT)
 
     def turretRight(self):
-        cmd = self.RIGHT_data + self.cmdFill
-        self.turretMove(cmd)
+        self.setDirection('right', self.RIGHT)
 
     def turretUp(self):
-        cmd = self.UP_data + self.cmdFill
-        self.turretMove(cmd)
+        self.setDirection('up', self.UP)
 
     def turretDown(self):
-        cmd = self.DOWN_data + self.cmdFill
-        self.turretMove(cmd)
+        self.setDirection('down', self.DOWN)
 
     def turretDirection(self, directionCommand):
-        cmd = self.BLANK_data + self.cmdFill
-        if (directionCommand & self.LEFT == self.LEFT ):
-                cmd[1] = 0x1
-        elif (directionCommand & self.RIGHT == self.RIGHT ):
-                cmd[2] = 0x1
-
-        if (directionCommand & self.UP == self.UP ):
-                cmd[3] = 0x1
-        elif (directionCommand & self.DOWN == self.DOWN ):
-                cmd[4] = 0x1
-
-        self.turretMove(cmd)
+        self.setDirection('direction', directionCommand)
 
     def turretFire(self):
-        cmd = self.FIRE + self.cmdFill
-        self.turretMove(cmd)
+        self.writer.send('fire', self.fire_command, resets_state=True)
 
     def turretStop(self):
-        cmd = self.STOP + self.cmdFill
-        self.turretMove(cmd)
+        self.setDirection('stop', 0)
 
     def ledOn(self):
         # cannot turn on LED. Device has no LED.
@@ -142,13 +465,9 @@ class Launcher1130(Launcher):
         # cannot turn off LED. Device has no LED.
         pass
 
-    # Missile launcher requires two init-packets before the actual command can be sent.
-    # The init-packets consist of 8 Bit payload, the actual command is 64 Bit payload
-    def turretMove(self, cmd):
-        # Two init-packets plus actual command
-        self.dev.ctrl_transfer(0x21, 0x09, 0x2, 0x01, [ord('U'), ord('S'), ord('B'), ord('C'), 0, 0, 4, 0])
-        self.dev.ctrl_transfer(0x21, 0x09, 0x2, 0x01, [ord('U'), ord('S'), ord('B'), ord('C'), 0, 64, 2, 0])
-        self.dev.ctrl_transfer(0x21, 0x09, 0x2, 0x00, cmd)
+    # waits for queued commands to reach the device
+    def dispose(self):
+        self.writer.dispose()
 
 
 
@@ -157,13 +476,14 @@ class Launcher2123(Launcher):
     # Low level launcher driver commands
     # this code mostly taken from https://github.com/nmilford/stormLauncher
     # with bits from https://github.com/codedance/Retaliation
-    def __init__(self):
-        self.dev = usb.core.find(idVendor=0x2123, idProduct=0x1010)
+    def __init__(self, coalesce_window=0.0, timeout=250, device_index=0, stats=metrics):
+        self.dev = find_device(0x2123, 0x1010, device_index)
 
         # HID detach for Linux systems...tested with 0x2123 product
 
         if self.dev is None:
             raise ValueError('Missile launcher not found.')
+        self.device = device_id(self.dev)
         if sys.platform == "linux2":
             try:
                 if self.dev.is_kernel_driver_active(1) is True:
@@ -173,6 +493,9 @@ class Launcher2123(Launcher):
             except Exception, e:
                 pass
 
+        # commands are written by a dedicated thread
+        self.writer = UsbCommandWriter(self.dev, coalesce_window, timeout, stats)
+
         #some physical constraints of our rocket launcher
         self.missile_capacity = 4
         #experimentally estimated speed scaling factors 
@@ -189,60 +512,194 @@ class Launcher2123(Launcher):
         self.LEFT = 0x04
         self.RIGHT = 0x08
 
-
+        # every command is built once, up front; movement states are keyed by their command byte
+        self.direction_commands = dict((direction, (transfer(0x21, 0x09, 0, 0, [0x02, direction, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]),))
+                                       for direction in range(16))
+        self.stop_command = (transfer(0x21, 0x09, 0, 0, [0x02, 0x20, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]),)
+        self.fire_command = (transfer(0x21, 0x09, 0, 0, [0x02, 0x10, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]),)
+        self.led_on_command = (transfer(0x21, 0x09, 0, 0, [0x03, 0x01, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]),)
+        self.led_off_command = (transfer(0x21, 0x09, 0, 0, [0x03, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]),)
 
     def turretUp(self):
-        self.dev.ctrl_transfer(0x21, 0x09, 0, 0, [0x02, 0x02, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
+        self.writer.set_state('up', self.UP, self.direction_commands[self.UP])
 
     def turretDown(self):
-        self.dev.ctrl_transfer(0x21, 0x09, 0, 0, [0x02, 0x01, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
+        self.writer.set_state('down', self.DOWN, self.direction_commands[self.DOWN])
 
     def turretLeft(self):
-        self.dev.ctrl_transfer(0x21, 0x09, 0, 0, [0x02, 0x04, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
+        self.writer.set_state('left', self.LEFT, self.direction_commands[self.LEFT])
 
     def turretRight(self):
-        self.dev.ctrl_transfer(0x21, 0x09, 0, 0, [0x02, 0x08, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
+        self.writer.set_state('right', self.RIGHT, self.direction_commands[self.RIGHT])
 
     def turretDirection(self,direction):
-        self.dev.ctrl_transfer(0x21, 0x09, 0, 0, [0x02, direction, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
+        self.writer.set_state('direction', direction, self.direction_commands[direction])
+
+    def turretStop(self):
+        self.writer.set_state('stop', 0x20, self.stop_command)
+
+    def turretFire(self):
+        self.writer.send('fire', self.fire_command, resets_state=True)
+
+    # the LED is a state of its own, so that turning it off on every frame only writes when it was on
+    def ledOn(self):
+        self.writer.set_state('led', True, self.led_on_command, channel='led')
+
+    def ledOff(self):
+        self.writer.set_state('led', False, self.led_off_command, channel='led')
+
+    # waits for queued commands to reach the device
+    def dispose(self):
+        self.writer.dispose()
+
+# Launcher that stands in for a DreamCheeky Thunder when no hardware is attached, for testing
+# the control loop. It models the turret position (as a fraction of each axis' range, from the
+# left and top end stops) from the timing of the commands it is given, and can add a fixed
+# latency to every command to mimic a slow USB round-trip.
+class SimulatedLauncher(Launcher):
+    def __init__(self, latency=0.0, x_position=0.5, y_position=0.5, stats=metrics):
+        #same physical constraints as the Launcher2123
+        self.missile_capacity = 4
+        self.y_speed = 0.48
+        self.x_speed = 1.2
+        self.x_range = 6.5
+        self.y_range = 0.75
+
+        self.DOWN = 0x01
+        self.UP = 0x02
+        self.LEFT = 0x04
+        self.RIGHT = 0x08
+
+        self.device = 'simulated'
+        self.latency = latency  # seconds added to every command
+        self.stats = stats      # where to record metrics (see Metrics.scoped())
+        self.lock = threading.Lock()
+        self.x_position = x_position
+        self.y_position = y_position
+        self.direction = 0
+        self.direction_time = time.time()
+        self.led = False
+        self.missiles_fired = 0
+
+        stats.gauge('sim.x_position', lambda: round(self.position()[0], 3))
+        stats.gauge('sim.y_position', lambda: round(self.position()[1], 3))
+
+    # brings the modelled position up to date with the movement since the last command
+    def update_position(self):
+        now = time.time()
+        elapsed = now - self.direction_time
+        self.direction_time = now
+        if self.direction & self.RIGHT:
+            self.x_position = min(1.0, self.x_position + elapsed / self.x_range)
+        elif self.direction & self.LEFT:
+            self.x_position = max(0.0, self.x_position - elapsed / self.x_range)
+        if self.direction & self.DOWN:
+            self.y_position = min(1.0, self.y_position + elapsed / self.y_range)
+        elif self.direction & self.UP:
+            self.y_position = max(0.0, self.y_position - elapsed / self.y_range)
+
+    def position(self):
+        self.lock.acquire()
+        self.update_position()
+        self.lock.release()
+        return self.x_position, self.y_position
+
+    # takes effect once the simulated transfer latency has passed, like a real command would
+    def transfer(self, command, direction=None):
+        start = clock()
+        if self.latency:
+            time.sleep(self.latency)
+        self.lock.acquire()
+        self.update_position()
+        if direction is not None:
+            self.direction = direction
+        self.lock.release()
+        self.stats.record_since('usb.' + command, start)
+
+    def turretUp(self):
+        self.transfer('up', self.UP)
+
+    def turretDown(self):
+        self.transfer('down', self.DOWN)
+
+    def turretLeft(self):
+        self.transfer('left', self.LEFT)
+
+    def turretRight(self):
+        self.transfer('right', self.RIGHT)
+
+    def turretDirection(self, direction):
+        self.transfer('direction', direction)
 
     def turretStop(self):
-        self.dev.ctrl_transfer(0x21, 0x09, 0, 0, [0x02, 0x20, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
+        self.transfer('stop', 0)
 
     def turretFire(self):
-        self.dev.ctrl_transfer(0x21, 0x09, 0, 0, [0x02, 0x10, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
+        self.transfer('fire')
+        self.missiles_fired += 1
 
     def ledOn(self):
-        self.dev.ctrl_transfer(0x21, 0x09, 0, 0, [0x03, 0x01, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
+        self.transfer('led')
+        self.led = True
 
     def ledOff(self):
-        self.dev.ctrl_transfer(0x21, 0x09, 0, 0, [0x03, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
+        self.transfer('led')
+        self.led = False
 
- 
 
 class Turret():
     def __init__(self, opts):
         self.opts = opts
+        # metrics of several turrets in one process (see supervisor.py) are kept apart by a prefix
+        self.stats = metrics.scoped(opts.metrics_prefix)
 
         # Choose correct Launcher
         if opts.launcherID == "1130":
-            self.launcher = Launcher1130()
+            self.launcher = Launcher1130(opts.usb_coalesce / 1000.0, opts.usb_timeout, opts.launcher_index,
+                                         self.stats)
+        elif opts.launcherID == "sim":
+            self.launcher = SimulatedLauncher(opts.sim_latency / 1000.0, stats=self.stats)
         else:
-            self.launcher = Launcher2123()
+            self.launcher = Launcher2123(opts.usb_coalesce / 1000.0, opts.usb_timeout, opts.launcher_index,
+                                         self.stats)
+
+        # this launcher's own speeds and ranges, if it has been calibrated (see calibrate.py)
+        if opts.calibration:
+            path = calibration_path(opts.calibration, opts.launcherID, self.launcher.device)
+            if path and os.path.exists(path):
+                try:
+                    self.launcher.calibrate(json.load(open(path)))
+                except (IOError, ValueError), e:
+                    print 'Could not load calibration ' + path + ': ' + str(e)
 
         self.missiles_remaining = self.launcher.missile_capacity
         self.origin_x, self.origin_y = map(float, opts.origin.split(','))
 
-        self.killcam_count = 0
         self.trackingTimer = time.time()
         self.locked_on = 0
+        self.centered_since_lock = False
+
+        # killcam shots and training photos are written in the background, numbered per directory
+        self.image_writer = ImageWriter(opts.jpeg_quality, opts.image_queue, self.stats)
+        self.killcam_files = None  # created when the first image is saved
+        self.training_store = None
+        self.killcam_pending = None  # (number, time) of a 'firing' shot still to be taken
 
-        self.bufferPhoto = 0
+        # after firing, the launcher must be left alone until this time
+        self.firing_until = 0
+
+        # timed moves run in the background so that detection can continue while moving
+        self.motion = MotionExecutor(self.launcher, stats=self.stats)
+        self.homed_at = None  # when center() last drove against the end stops
 
         # initial setup
         # self.center()
         self.launcher.ledOff()
 
+        # with --mode=scan, the turret patrols continuously along a path covering its whole range
+        self.scanning = False
+        self.scan_from_top = True
+
         if opts.mode == "sweep":
             self.approx_x_position = self.origin_x
             self.approx_y_position = self.origin_y
@@ -253,17 +710,36 @@ class Turret():
 
     # turn off turret properly
     def dispose(self):
+        self.motion.dispose()
         self.launcher.turretStop()
         self.launcher.ledOff()
+        self.launcher.dispose()
+        self.image_writer.dispose()
+        if self.training_store:
+            self.training_store.close()
 
     # roughly centers the turret to the middle of range or origin point if specified
+    # (returns immediately; the move runs in the background). This is a single move from where the
+    # turret is estimated to be, except that it is re-homed against the end stops (a slow move across
+    # its whole range) the first time, every rehome_interval seconds, and when the estimate may be
+    # off by more than rehome_error
     def center(self):
-        self.launcher.center(self.origin_x, self.origin_y)
+        pose = self.motion.pose
+        if (self.homed_at is None or time.time() - self.homed_at > self.opts.rehome_interval
+                or pose.error() > self.opts.rehome_error):
+            print 'Centering camera (re-homing) ...'
+            self.homed_at = time.time()
+            self.motion.replace(self.launcher.positionSegments(self.origin_x, self.origin_y))
+        else:
+            print 'Centering camera ...'
+            x, y = pose.position()
+            self.motion.replace(self.launcher.relativeSegments(self.origin_x - x, self.origin_y - y))
 
     # adjusts the turret's position (units are fairly arbitary but work ok)
-    def adjust(self, right_dist, down_dist):
-        right_seconds = right_dist * self.launcher.x_speed
-        down_seconds = down_dist * self.launcher.y_speed
+    # the move replaces any move in progress and runs in the background unless wait is set
+    def adjust(self, right_dist, down_dist, wait=False):
+        right_seconds = right_dist * self.launcher.speed(self.launcher.RIGHT if right_dist > 0 else self.launcher.LEFT)
+        down_seconds = down_dist * self.launcher.speed(self.launcher.DOWN if down_dist > 0 else self.launcher.UP)
 
         direction_right = 0
         direction_down = 0
@@ -278,60 +754,53 @@ class Turret():
         elif down_seconds < 0:
             direction_down = self.launcher.UP
 
-        # move diagonally first
-        self.launcher.turretDirection(direction_down | direction_right)
-
-        # move remaining distance in one direction
+        # move diagonally first, then move remaining distance in one direction
         if abs(right_seconds) > abs(down_seconds):
-            time.sleep(abs(down_seconds))
-            self.launcher.turretDirection(direction_right)
-            time.sleep(abs(right_seconds-down_seconds))            
+            segments = [(direction_down | direction_right, abs(down_seconds)),
+                        (direction_right, abs(right_seconds-down_seconds))]
         else:
-            time.sleep(abs(right_seconds))
-            self.launcher.turretDirection(direction_down)
-            time.sleep(abs(down_seconds-right_seconds))          
-        
-        self.launcher.turretStop()
+            segments = [(direction_down | direction_right, abs(right_seconds)),
+                        (direction_down, abs(down_seconds-right_seconds))]
 
-        # OpenCV takes pictures VERY quickly, so if we use it, we must
-        # add an artificial delay to reduce camera wobble and improve clarity
-        time.sleep(.2)
+        # the executor stops the turret afterwards and tracks the settle delay
+        self.motion.replace(segments)
+        if wait:
+            self.motion.wait()
 
     # stores images of the targets within the killcam folder
     def killcam(self, camera):
-        # create killcam dir if none exists, then find first unused filename
-        if not os.path.exists("killcam"):
-            os.makedirs("killcam")
-        filename_locked_on = os.path.join("killcam", "lockedon" + str(self.killcam_count) + ".jpg")
-        while os.path.exists(filename_locked_on):
-            self.killcam_count += 1
-            filename_locked_on = os.path.join("killcam", "lockedon" + str(self.killcam_count) + ".jpg")
+        if self.killcam_files is None:
+            self.killcam_files = FileSequence("killcam", ["lockedon", "firing"])
+        number = self.killcam_files.next()
 
         # save the image with the target being locked on
-        cv2.imwrite(filename_locked_on, camera.frame_mod)
+        self.image_writer.write(self.killcam_files.path("lockedon", number), camera.annotated(), droppable=False)
 
-        # wait a little bit to attempt to catch the target's reaction.
-        time.sleep(1)  # tweak this value for most hilarious action shots
+        # another picture of the target while it is being fired upon is taken from the first frame captured
+        # a little later, to attempt to catch the target's reaction (see update_killcam())
+        self.killcam_pending = (number, time.time() + 1)  # tweak this value for most hilarious action shots
 
-        # force camera to obtain image after this point
-        camera.new_frame_available = False
-
-        # take another picture of the target while it is being fired upon
-        filename_firing = os.path.join("killcam", "firing" + str(self.killcam_count) + ".jpg")
-        camera.face_detect(filename=filename_firing) 
-        if not self.opts.no_display:
-            camera.display()
-
-        self.killcam_count += 1
+    # saves the pending 'firing' killcam shot once a late enough frame has come in
+    def update_killcam(self, camera):
+        if self.killcam_pending and camera.frame_time >= self.killcam_pending[1]:
+            number = self.killcam_pending[0]
+            self.image_writer.write(self.killcam_files.path("firing", number), camera.annotated(), droppable=False)
+            self.killcam_pending = None
 
+    # offers the target's face to the training photo collection (which keeps few enough to be useful)
     def save_image(self, camera):
-        photo_dir = "photoForTraining"
-        if not os.path.exists(photo_dir):
-            os.makedirs(photo_dir)
-
-        self.bufferPhoto += 1
-        filename = os.path.join(photo_dir, "photo" + str(self.bufferPhoto) + ".jpg")
-        cv2.imwrite(filename, camera.current_frame)
+        target = camera.tracker.target()
+        if target is None or self.opts.training_rate <= 0:
+            return
+        if self.training_store is None:
+            self.training_store = TrainingStore("photoForTraining", self.image_writer,
+                                                self.opts.training_rate, self.opts.training_dedup)
+        self.training_store.add(camera.current_frame, camera.frame_box(target.box), camera.frame_time,
+                                target.cascade, target.id)
+
+    # True while the launcher is still firing; it must not be moved (or told to stop) until it is done
+    def is_firing(self):
+        return time.time() < self.firing_until
 
     # compensate vertically for distance to target
     def projectile_compensation(self, target_y_size):
@@ -343,7 +812,7 @@ class Turret():
             adjust_amount = 0
 
         # tilt the turret up to try to increase range
-        self.adjust(0, adjust_amount)
+        self.adjust(0, adjust_amount, wait=True)
         if self.opts.verbose:
             print "size of target: %.6f" % target_y_size
             print "compensation amount: %.6f" % adjust_amount
@@ -352,10 +821,19 @@ class Turret():
     def ready_aim_fire(self, x_adj, y_adj, target_y_size, face_detected, camera=None):
         fired = False
 
+        if camera:
+            self.update_killcam(camera)
+        if self.is_firing():
+            return fired
+
         if face_detected and camera:
             self.save_image(camera)
 
         if face_detected and abs(x_adj) < .05 and abs(y_adj) < .05:
+            if self.locked_on and not self.centered_since_lock:
+                # how long it took to bring a newly found target into the sights
+                self.stats.record('tracking.time_to_center', time.time() - self.trackingTimer)
+                self.centered_since_lock = True
             self.launcher.ledOn()  # LED will turn on when target is locked
             if self.opts.armed:
                 # aim a little higher if our target is in the distance
@@ -368,7 +846,8 @@ class Turret():
                 if camera:
                     self.killcam(camera)  # save a picture of the target
 
-                time.sleep(3)  # disable turret for approximate time required to fire
+                # disable turret for approximate time required to fire; detection carries on meanwhile
+                self.firing_until = time.time() + 3
 
                 print 'Missile fired! Estimated ' + str(self.missiles_remaining) + ' missiles remaining.'
 
@@ -390,6 +869,7 @@ class Turret():
                 trackingDuration = time.time() - self.trackingTimer
             else:
                 self.locked_on = True
+                self.centered_since_lock = False
                 self.trackingTimer = time.time()
                 trackingDuration = 0
         else: #not locked on
@@ -401,12 +881,51 @@ class Turret():
                 trackingDuration = -(time.time() - self.trackingTimer)
         return trackingDuration #negative values indicate time since target seen
 
-    #increments the sweeping behaviour of a turret on patrol
+    # starts a pass of the continuous patrol (returns immediately; the pass runs in the background
+    # and detection carries on meanwhile)
+    def scan(self):
+        self.scanning = True
+        self.motion.replace(self.scanSegments())
+
+    # breaks off the patrol, e.g. to track a face that has appeared
+    def stop_scan(self):
+        if self.scanning:
+            self.scanning = False
+            self.motion.cancel()
+
+    # a pass over the whole range at the launcher's own steady speed: rows across, far enough apart
+    # for consecutive rows to overlap by a fifth of the image, taken from the top and bottom in turn.
+    # The rows run a little past the end stops, which keeps the pose estimate from drifting.
+    def scanSegments(self, overlap=.2, overshoot=.05):
+        launcher = self.launcher
+        x, y = self.motion.pose.position()
+
+        spacing = (1 - overlap) * launcher.speed(launcher.DOWN) / launcher.y_range
+        count = max(int(math.ceil(1 / spacing)), 1) + 1
+        rows = [i / float(count - 1) for i in range(count)]
+        if not self.scan_from_top:
+            rows.reverse()
+        self.scan_from_top = not self.scan_from_top
+
+        segments = []
+        x_direction = launcher.RIGHT if x < .5 else launcher.LEFT
+        for row in rows:
+            if row != y:
+                distance = abs(row - y) + (overshoot if row in (0, 1) else 0)
+                segments.append((launcher.DOWN if row > y else launcher.UP, distance * launcher.y_range))
+                y = row
+            distance = (1 - x if x_direction == launcher.RIGHT else x) + overshoot
+            segments.append((x_direction, distance * launcher.x_range))
+            x = 1 if x_direction == launcher.RIGHT else 0
+            x_direction = launcher.LEFT if x_direction == launcher.RIGHT else launcher.RIGHT
+        return segments
+
+    #increments the sweeping behaviour of a turret on patrol (the step runs in the background)
     def sweep(self):
         self.approx_x_position += self.sweep_x_direction * self.sweep_x_step
         if self.approx_x_position<=1 and self.approx_x_position>=0:
             #move in x direction first
-            self.launcher.moveRelative(self.sweep_x_step * self.sweep_x_direction, 0)
+            self.motion.submit(self.launcher.relativeSegments(self.sweep_x_step * self.sweep_x_direction, 0))
         else:
             #reached end of x range.  move in y direction and switch x sweep direction
             self.sweep_x_direction = -1 * self.sweep_x_direction
@@ -414,10 +933,9 @@ class Turret():
             self.approx_y_position += self.sweep_y_direction * self.sweep_y_step
             if(self.approx_y_position<=1 and self.approx_y_position>=0): 
                 #take a step in current y direction
-                self.launcher.moveRelative(0, 0.2 * self.sweep_y_direction)
+                self.motion.submit(self.launcher.relativeSegments(0, 0.2 * self.sweep_y_direction))
             else:
                 #swap y direction and take a step in that direction instead
                 self.sweep_y_direction = -1 * self.sweep_y_direction
                 self.approx_y_position += self.sweep_y_direction * 2 * self.sweep_y_step # reverse previous y step and take a new step 
-                self.launcher.moveRelative(0, self.sweep_y_step * self.sweep_y_direction)
-        time.sleep(.2) #allow camera to stabilize
+                self.motion.submit(self.launcher.relativeSegments(0, self.sweep_y_step * self.sweep_y_direction))
@@ -0,0 +1,142 @@
+import array
+import collections
+import threading
+import time
+from metrics import metrics, clock
+
+# builds a control transfer whose payload is converted to a byte array once, up front, so that
+# sending it costs no list building or conversion. Payloads must not be modified afterwards.
+def transfer(bmRequestType, bRequest, wValue, wIndex, payload):
+    return (bmRequestType, bRequest, wValue, wIndex, array.array('B', payload))
+
+# Writes launcher commands to a USB device from a dedicated I/O thread, so that callers never wait
+# for a USB round-trip. Commands are a name (for metrics) and a tuple of prebuilt transfers.
+#
+# Movement and LED commands set a state (the direction the turret is moving in, or stopped; the LED
+# on or off), identified by a key, on a channel of its own ('motion' or 'led'). A state that is
+# already in effect is not written again, and a state that is still waiting to be written is replaced
+# by a newer one of its channel rather than queued behind it; with a coalescing window, a new state
+# is held back that long in case it is superseded. Other commands (fire) are always written, in order
+# with the states around them.
+class UsbCommandWriter():
+    def __init__(self, dev, coalesce_window=0.0, timeout=250, stats=metrics):
+        self.dev = dev
+        self.stats = stats  # where to record metrics (see Metrics.scoped())
+        self.coalesce_window = coalesce_window  # seconds
+        self.timeout = timeout                  # milliseconds per transfer
+
+        self.queue = collections.deque()  # [name, transfers, state key or None, time queued, resets state, channel]
+        self.condition = threading.Condition()
+        self.sent_state = {}  # channel: key of the state the device is in (missing if unknown)
+        self.writing = None   # channel whose state is being written (or reset), if any
+        self.busy = False
+        self.running = True
+
+        self.writes_skipped = 0
+        self.states_coalesced = 0
+        self.errors = 0
+        self.stats.gauge('usb.writes_skipped', lambda: self.writes_skipped)
+        self.stats.gauge('usb.states_coalesced', lambda: self.states_coalesced)
+        self.stats.gauge('usb.errors', lambda: self.errors)
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def set_state(self, name, key, transfers, channel='motion'):
+        self.condition.acquire()
+        pending = self.pending_state(channel)
+        if pending is not None:
+            # a state of this channel hasn't been written yet: replace it
+            pending[:3] = [name, transfers, key]
+            self.states_coalesced += 1
+        elif (self.writing != channel and self.sent_state.get(channel) == key and
+                not any(command[5] == channel for command in self.queue)):
+            self.writes_skipped += 1  # already in effect (e.g. the LED being turned off every frame)
+        else:
+            self.queue.append([name, transfers, key, time.time(), False, channel])
+        self.condition.notify_all()
+        self.condition.release()
+
+    # the queued state of the channel that may still be replaced: one that no one-off command is
+    # queued behind, so that replacing it doesn't change what the device is in when that runs
+    def pending_state(self, channel):
+        for command in reversed(self.queue):
+            if command[2] is None:
+                return None
+            if command[5] == channel:
+                return command
+        return None
+
+    # queues a one-off command; resets_state if it changes the device's movement state (e.g. firing)
+    def send(self, name, transfers, resets_state=False):
+        self.condition.acquire()
+        # one that resets the movement state is queued on that channel, so that the state set after
+        # it is written even if it is the one the device was in before
+        self.queue.append([name, transfers, None, time.time(), resets_state, 'motion' if resets_state else None])
+        self.condition.notify_all()
+        self.condition.release()
+
+    # blocks until every queued command has been written
+    def flush(self):
+        self.condition.acquire()
+        while self.running and (self.queue or self.busy):
+            self.condition.wait()
+        self.condition.release()
+
+    def dispose(self):
+        self.flush()
+        self.condition.acquire()
+        self.running = False
+        self.condition.notify_all()
+        self.condition.release()
+        self.thread.join()
+
+    def run(self):
+        while True:
+            self.condition.acquire()
+            while self.running and not self.queue:
+                self.condition.wait()
+            if not self.running:
+                self.condition.release()
+                return
+
+            # give a new state the chance to be superseded before writing it
+            command = self.queue[0]
+            while command[2] is not None and len(self.queue) == 1 and self.running:
+                remaining = command[3] + self.coalesce_window - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            command = self.queue.popleft()
+            name, transfers, key = command[:3]
+            channel = command[5]
+            self.busy = True
+            self.writing = channel if key is not None or command[4] else None
+            self.condition.release()
+
+            if key is not None and key == self.sent_state.get(channel):
+                self.writes_skipped += 1
+            else:
+                start = clock()
+                try:
+                    for bmRequestType, bRequest, wValue, wIndex, payload in transfers:
+                        self.dev.ctrl_transfer(bmRequestType, bRequest, wValue, wIndex, payload, self.timeout)
+                    if key is not None:
+                        self.sent_state[channel] = key
+                    elif command[4]:
+                        self.sent_state.pop(channel, None)
+                except Exception, e:
+                    # not just USBError: if this thread died, flush() and dispose() would wait forever.
+                    # The device may or may not have acted on it, so don't trust the state we think it's in
+                    self.errors += 1
+                    self.sent_state.pop(channel, None)
+                    print 'USB error sending ' + name + ': ' + str(e)
+                self.stats.record_since('usb.' + name, start)
+
+            self.condition.acquire()
+            self.busy = False
+            self.writing = None
+            self.condition.notify_all()
+            self.condition.release()